@@ -34,7 +34,15 @@ SELECT
   u.home_airport_lon,
   f.destination_airport_lat,
   f.destination_airport_lon,
-  f.checked_bags
+  f.checked_bags,
+  -- raw values needed to rebuild the All_info_combined.sql metrics in src/feature_support.py
+  s.session_start,
+  s.flight_discount_amount,
+  s.hotel_discount_amount,
+  h.nights,
+  f.origin_airport,
+  f.destination_airport,
+  u.home_airport
 FROM UserSessions us
 JOIN users u ON u.user_id = us.user_id
 LEFT JOIN sessions s ON s.user_id = u.user_id
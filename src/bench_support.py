@@ -0,0 +1,122 @@
+# Import the needed libraries
+
+import argparse
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from src import db_support as dbs
+from src import synth_support as synth
+
+# End to end timings of the SQL files on synthetic DuckDB databases of growing size. Results are
+# appended to a CSV so query regressions show up when runs are compared over time.
+
+DEFAULT_SQL_FILES = [os.path.join('SQL', 'All_Data.sql'), os.path.join('SQL', 'All_info_combined.sql')]
+DEFAULT_SCALES = (1, 10, 100)
+DEFAULT_DATA_DIR = 'bench_data'
+DEFAULT_RESULTS_PATH = os.path.join('bench_data', 'benchmark_results.csv')
+
+
+def benchmark_database(scale, data_dir=DEFAULT_DATA_DIR, seed=42):
+    """
+    Returns the path of the synthetic DuckDB file for a scale, generating it on first use.
+    """
+    path = os.path.join(data_dir, f'traveltide_x{scale}_seed{seed}.duckdb')
+    if not os.path.exists(path):
+        synth.build_duckdb(path, scale=scale, seed=seed)
+    return path
+
+
+def time_sql_file(sql_file_path, repeat=3):
+    """
+    Time execute_sql_file end to end (query plus DataFrame conversion) on the current engine.
+
+    Returns:
+    - list of dicts with run number, seconds and rows. A first untimed run warms the caches.
+    """
+    dbs.execute_sql_file(sql_file_path)
+    runs = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        df = dbs.execute_sql_file(sql_file_path)
+        runs.append({'run': run, 'seconds': time.perf_counter() - start, 'rows': len(df)})
+    return runs
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, sql_files=DEFAULT_SQL_FILES, repeat=3, data_dir=DEFAULT_DATA_DIR,
+                   seed=42, results_path=DEFAULT_RESULTS_PATH):
+    """
+    Time every SQL file at every scale.
+
+    Parameters:
+    - scales: multiples of synth.BASE_USERS users.
+    - sql_files: SQL files to time.
+    - repeat (int): timed runs per file and scale.
+    - data_dir (str): folder of the generated databases, reused between runs.
+    - seed (int): seed of the generated data.
+    - results_path (str): CSV the results are appended to, None to skip saving.
+
+    Returns:
+    - pd.DataFrame with one row per timed run.
+    """
+    started = datetime.now().isoformat(timespec='seconds')
+    rows = []
+    for scale in scales:
+        synth.use_duckdb(benchmark_database(scale, data_dir, seed))
+        table_rows = {table: stats['rows'] for table, stats in dbs.table_stats().items()}
+        for sql_file_path in sql_files:
+            for result in time_sql_file(sql_file_path, repeat):
+                rows.append({
+                    'started': started,
+                    'scale': scale,
+                    'users': table_rows.get('users'),
+                    'sessions': table_rows.get('sessions'),
+                    'query': os.path.basename(sql_file_path),
+                    **result,
+                })
+        dbs.dispose_engine()
+
+    results = pd.DataFrame(rows)
+    if results_path:
+        os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+        results.to_csv(results_path, mode='a', header=not os.path.exists(results_path), index=False)
+    return results
+
+
+def summarize(results):
+    """
+    Median and best time per query and scale.
+    """
+    return (results.groupby(['started', 'query', 'scale', 'users', 'sessions'])['seconds']
+            .agg(['median', 'min', 'count']).reset_index())
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """
+    Flag queries whose median time grew by more than tolerance (0.2 = 20%) against a baseline run.
+
+    Parameters:
+    - results, baseline: DataFrames from run_benchmarks (e.g. two runs read back from the results CSV).
+
+    Returns:
+    - pd.DataFrame per query and scale with both medians, the ratio and a 'regression' flag.
+    """
+    current = results.groupby(['query', 'scale'])['seconds'].median().rename('median_seconds')
+    previous = baseline.groupby(['query', 'scale'])['seconds'].median().rename('baseline_seconds')
+    report = pd.concat([current, previous], axis=1, join='inner').reset_index()
+    report['ratio'] = report['median_seconds'] / report['baseline_seconds']
+    report['regression'] = report['ratio'] > 1 + tolerance
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the TravelTide SQL files on synthetic data.')
+    parser.add_argument('--scales', type=float, nargs='+', default=list(DEFAULT_SCALES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--results', default=DEFAULT_RESULTS_PATH)
+    arguments = parser.parse_args()
+
+    scales = [int(scale) if scale == int(scale) else scale for scale in arguments.scales]
+    print(summarize(run_benchmarks(scales, repeat=arguments.repeat, data_dir=arguments.data_dir,
+                                   results_path=arguments.results)).to_string(index=False))
@@ -0,0 +1,99 @@
+# Import the needed libraries
+
+import hashlib
+import json
+import os
+import pandas as pd
+
+# Cached results are stored as Parquet files (needs pyarrow) in this folder, relative to the notebook
+DEFAULT_CACHE_DIR = 'cache'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def cache_key(*parts):
+    """
+    Build a stable cache key from the query text and anything else the result depends on.
+
+    :param parts: JSON serialisable values, e.g. the SQL text and a table fingerprint.
+    :return: hex digest used as the cache file name.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f'{key}.parquet')
+
+
+def load_cached(cache_dir, key):
+    """
+    Load a cached result, or return None when there is no entry for the key.
+
+    A hit touches the file so the least recently used entries are the ones evicted.
+    """
+    path = cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+
+    df = pd.read_parquet(path)
+    os.utime(path)
+    return df
+
+
+def store_cached(df, cache_dir, key, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Write a result to the cache and evict old entries to stay under max_bytes.
+
+    :param df: DataFrame to cache.
+    :param cache_dir: cache folder, created if missing.
+    :param key: key from cache_key.
+    :param max_bytes: size budget for the whole cache folder.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, key)
+
+    # Write to a temp file first so a crashed run never leaves a half written entry behind
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    evict_cache(cache_dir, max_bytes, keep=path)
+    return path
+
+
+def evict_cache(cache_dir, max_bytes=DEFAULT_MAX_BYTES, keep=None):
+    """
+    Delete the least recently used entries until the cache fits in max_bytes.
+
+    :param cache_dir: cache folder.
+    :param max_bytes: size budget for the whole cache folder.
+    :param keep: path that must not be evicted (the entry just written).
+    :return: list of removed paths.
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.parquet'):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = []
+    # Oldest first
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total_bytes -= size
+        removed.append(path)
+
+    return removed
+
+
+def clear_cache(cache_dir=DEFAULT_CACHE_DIR):
+    return evict_cache(cache_dir, max_bytes=-1)
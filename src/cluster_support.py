@@ -0,0 +1,255 @@
+# Import the needed libraries
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from src import db_support as dbs
+from src.lazy_support import lazy_import
+
+# scikit-learn and joblib take seconds to import, they are loaded when a model is fitted or loaded
+joblib = lazy_import('joblib')
+sk_cluster = lazy_import('sklearn.cluster')
+sk_metrics = lazy_import('sklearn.metrics')
+sk_preprocessing = lazy_import('sklearn.preprocessing')
+
+# Out of core version of the notebook's perk segmentation: the StandardScaler is fitted
+# incrementally and mini-batch k-means is trained over chunks streamed from the database, then a
+# second streaming pass assigns cluster / cluster_label. Memory is bounded by the chunk size.
+
+# Features used for the segmentation (same list as the notebook)
+FEATURES = ['total_cancellation_rate', 'average_checked_bags', 'conversion_rate',
+            'prefers_flights', 'prefers_hotels', 'prefers_both',
+            'discount_responsiveness', 'flight_discount_proportion', 'average_flight_discount',
+            'hotel_discount_proportion', 'average_hotel_discount', 'both_discount_proportion',
+            'flight_hunter_index', 'hotel_hunter_index',
+            'total_hotel_usd_spent', 'total_flight_usd_spent', 'avg_nights']
+SCALED_COLUMNS = [feature + '_scaled' for feature in FEATURES]
+
+# Perk of each cluster of the notebook model. Cluster numbers depend on the fit, check the
+# centroids (e.g. with plot_cluster_heatmap) before reusing this map for a newly trained model.
+CLUSTER_LABELS = {
+    0: "1 Night Free Hotel with Flight",
+    1: "Exclusive Discounts",
+    2: "No Cancellation Fee",
+    3: "Free Checked Bag",
+    4: "Free Hotel Meal",
+}
+
+COMBINED_SQL = os.path.join('SQL', 'All_info_combined.sql')
+DEFAULT_MODEL_PATH = os.path.join('models', 'perk_segmentation.joblib')
+
+
+def prepare_features(df, features=FEATURES):
+    """
+    Feature matrix of a chunk: derives flight_hunter_index when the SQL result does not have it
+    yet and fills the NULL total_nights like the notebook does.
+    """
+    df = df.copy()
+    if 'flight_hunter_index' not in df:
+        df['flight_hunter_index'] = df['scaled_ads_per_km'] * df['flight_discount_proportion'] * df['average_flight_discount']
+    if 'total_nights' in df:
+        df['total_nights'] = df['total_nights'].fillna(0)
+    return df[features].astype(float)
+
+
+def fit_scaler(chunks, features=FEATURES):
+    """
+    Fit a StandardScaler one chunk at a time.
+
+    Parameters:
+    - chunks: iterable of feature DataFrames.
+    - features (list): columns to scale.
+    """
+    scaler = sk_preprocessing.StandardScaler()
+    for chunk in chunks:
+        scaler.partial_fit(prepare_features(chunk, features))
+    return scaler
+
+
+def fit_minibatch_kmeans(chunk_source, scaler, n_clusters=5, epochs=3, batch_size=4096, random_state=42,
+                         features=FEATURES):
+    """
+    Train mini-batch k-means over streamed chunks.
+
+    Parameters:
+    - chunk_source: function returning a new iterable of chunks for every pass over the data
+      (e.g. lambda: dbs.execute_sql_file(path, chunksize=100000)).
+    - scaler: fitted StandardScaler from fit_scaler.
+    - n_clusters (int): number of clusters.
+    - epochs (int): passes over the data.
+    - batch_size (int): rows per mini-batch update inside a chunk.
+    - random_state (int): seed for the centroid initialisation.
+
+    Returns:
+    - fitted MiniBatchKMeans.
+    """
+    model = sk_cluster.MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=random_state, n_init=3)
+    held_back = None
+    for _ in range(epochs):
+        for chunk in chunk_source():
+            scaled = scaler.transform(prepare_features(chunk, features))
+            if held_back is not None:
+                scaled = np.vstack([held_back, scaled])
+                held_back = None
+            # The first update initialises the centroids and needs a few rows per cluster
+            if not hasattr(model, 'cluster_centers_') and len(scaled) < 3 * n_clusters:
+                held_back = scaled
+                continue
+            for start in range(0, len(scaled), batch_size):
+                model.partial_fit(scaled[start:start + batch_size])
+
+    if not hasattr(model, 'cluster_centers_'):
+        raise ValueError(f"need at least {3 * n_clusters} rows to fit {n_clusters} clusters")
+    return model
+
+
+def save_model(scaler, model, labels=CLUSTER_LABELS, path=DEFAULT_MODEL_PATH, features=FEATURES):
+    """
+    Save the scaler, centroids and label map together, returns the path.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    joblib.dump({
+        'features': list(features),
+        'scaler': scaler,
+        'centroids': model.cluster_centers_,
+        'labels': dict(labels),
+        'model': model,
+    }, path)
+    return path
+
+
+def load_model(path=DEFAULT_MODEL_PATH):
+    """
+    Load a bundle written by save_model: dict with features, scaler, centroids, labels and model.
+    """
+    return joblib.load(path)
+
+
+def nearest_centroid(scaled, centroids):
+    """
+    Index of the closest centroid for every row of a scaled feature matrix.
+    """
+    # ||x||^2 is the same for every centroid so it can be left out
+    distances = (centroids ** 2).sum(axis=1) - 2 * scaled @ centroids.T
+    return distances.argmin(axis=1)
+
+
+def assign_clusters(chunks, bundle, add_scaled=True):
+    """
+    Second streaming pass: yield every chunk with cluster and cluster_label columns added
+    (and the *_scaled feature columns when add_scaled is True).
+
+    Parameters:
+    - chunks: iterable of feature DataFrames.
+    - bundle (dict): from load_model or save_model's contents.
+    """
+    features = bundle['features']
+    centroids = np.asarray(bundle['centroids'])
+    for chunk in chunks:
+        scaled = bundle['scaler'].transform(prepare_features(chunk, features))
+        labelled = chunk.copy()
+        if add_scaled:
+            labelled[[feature + '_scaled' for feature in features]] = scaled
+        labelled['cluster'] = nearest_centroid(scaled, centroids)
+        labelled['cluster_label'] = labelled['cluster'].map(bundle['labels'])
+        yield labelled
+
+
+def train_from_sql(sql_file_path=COMBINED_SQL, chunksize=100000, n_clusters=5, epochs=3, labels=CLUSTER_LABELS,
+                   path=DEFAULT_MODEL_PATH, random_state=42):
+    """
+    Fit the scaler and mini-batch k-means on the SQL result streamed in chunks and save the model.
+
+    Returns:
+    - the saved bundle (see load_model).
+    """
+    def chunk_source():
+        return dbs.execute_sql_file(sql_file_path, chunksize=chunksize)
+
+    scaler = fit_scaler(chunk_source())
+    model = fit_minibatch_kmeans(chunk_source, scaler, n_clusters=n_clusters, epochs=epochs, random_state=random_state)
+    save_model(scaler, model, labels, path)
+    return load_model(path)
+
+
+def label_from_sql(bundle, sql_file_path=COMBINED_SQL, chunksize=100000):
+    """
+    Stream the SQL result and yield labelled chunks, see assign_clusters.
+    """
+    return assign_clusters(dbs.execute_sql_file(sql_file_path, chunksize=chunksize), bundle)
+
+
+def _silhouette(data, labels, sample_size, random_state):
+    # Not defined for a single cluster (or one cluster per row)
+    if not 1 < len(np.unique(labels)) < len(data):
+        return np.nan
+    sample_size = min(sample_size, len(data)) if sample_size else None
+    return float(sk_metrics.silhouette_score(data, labels, sample_size=sample_size, random_state=random_state))
+
+
+def _fit_k(data, k, n_init, random_state, silhouette_sample, init='k-means++'):
+    start = time.perf_counter()
+    model = sk_cluster.KMeans(n_clusters=k, n_init=n_init if isinstance(init, str) else 1, init=init, random_state=random_state)
+    labels = model.fit_predict(data)
+    return {
+        'k': k,
+        'inertia': float(model.inertia_),
+        'silhouette': _silhouette(data, labels, silhouette_sample, random_state),
+        'iterations': int(model.n_iter_),
+        'seconds': time.perf_counter() - start,
+        'centroids': model.cluster_centers_,
+    }
+
+
+def _next_init(data, centroids):
+    # Previous centroids plus the point farthest from all of them (deterministic k-means++ step).
+    # ||x - c||^2 = ||x||^2 + ||c||^2 - 2 x.c keeps the temporaries at n x k instead of n x k x d
+    distances = data @ centroids.T
+    distances *= -2
+    distances += (centroids ** 2).sum(axis=1)
+    distances = np.einsum('ij,ij->i', data, data) + distances.min(axis=1)
+    return np.vstack([centroids, data[distances.argmax()]])
+
+
+def elbow_sweep(data, cluster_ranges=range(1, 15), n_init=10, random_state=42, n_jobs=None, warm_start=False,
+                silhouette_sample=10000):
+    """
+    Fit k-means for every k and collect the model selection numbers, without any plotting.
+
+    Parameters:
+    - data: scaled feature matrix (DataFrame or array).
+    - cluster_ranges: values of k to try.
+    - n_init (int): restarts per k for cold starts.
+    - random_state (int): seed for the fits and the silhouette sample.
+    - n_jobs (int): worker processes for the cold start fits, None or 1 to fit in this process.
+    - warm_start (bool): fit the k values in increasing order, each one starting from the
+      previous centroids plus the farthest point, with a single init instead of n_init restarts.
+      The fits depend on each other, so warm start runs sequentially and ignores n_jobs.
+    - silhouette_sample (int): rows sampled for the silhouette score, None for all rows.
+
+    Returns:
+    - pd.DataFrame with k, inertia, silhouette, iterations and seconds per k.
+    """
+    data = np.asarray(data, dtype=float)
+    ks = sorted(cluster_ranges)
+
+    if warm_start:
+        results = []
+        centroids = None
+        for k in ks:
+            if centroids is not None and len(centroids) == k - 1:
+                result = _fit_k(data, k, n_init, random_state, silhouette_sample, init=_next_init(data, centroids))
+            else:
+                result = _fit_k(data, k, n_init, random_state, silhouette_sample)
+            centroids = result['centroids']
+            results.append(result)
+    elif n_jobs and n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_fit_k, data, k, n_init, random_state, silhouette_sample) for k in ks]
+            results = [future.result() for future in futures]
+    else:
+        results = [_fit_k(data, k, n_init, random_state, silhouette_sample) for k in ks]
+
+    return pd.DataFrame(results).drop(columns='centroids')
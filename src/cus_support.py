@@ -1,8 +1,25 @@
 import pandas as pd
-import ipywidgets as widgets
-from IPython.display import display
+from src.summary_support import ClusterSummary
+from src.lazy_support import lazy_import
+
+# Notebook only dependencies, imported when the first widget is built
+widgets = lazy_import('ipywidgets')
+ipython_display = lazy_import('IPython.display')
+
+def print_clusters_as_tab(df, scaled_columns, num_clusters=5, summary=None):
+    """
+    Show the mean scaled values of every cluster in a tab widget.
+
+    Parameters:
+    - df: pandas DataFrame with a 'cluster' column (not scanned when summary is given).
+    - scaled_columns: columns to show.
+    - num_clusters: number of clusters.
+    - summary: ClusterSummary of df, shared with the other cluster views.
+    """
+    if summary is None:
+        summary = ClusterSummary(df, 'cluster', columns=scaled_columns)
+    cluster_means = summary.means(scaled_columns).reindex(range(num_clusters))
 
-def print_clusters_as_tab(df, scaled_columns, num_clusters=5):
     tab = widgets.Tab()
     children = []
     
@@ -10,7 +27,7 @@ def print_clusters_as_tab(df, scaled_columns, num_clusters=5):
         output = widgets.Output()
         with output:
             print(f"Cluster {cluster}")
-            print(df[df['cluster'] == cluster][scaled_columns].mean())
+            print(cluster_means.loc[cluster])
             print('-' * 50)
         children.append(output)
     
@@ -18,4 +35,4 @@ def print_clusters_as_tab(df, scaled_columns, num_clusters=5):
     for i in range(num_clusters):
         tab.set_title(i, f"Cluster {i}")
     
-    display(tab)
\ No newline at end of file
+    ipython_display.display(tab)
\ No newline at end of file
@@ -1,58 +1,434 @@
 # Import the needed libraries
 
 import pandas as pd
-import sqlalchemy as sa
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from concurrent.futures import CancelledError, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from src import cache_support
+from src.lazy_support import lazy_import
 
-# Get the DB URL from environment file in order execute you must have the .env file in your root folder with URL string
-load_dotenv()  # This loads the .env file
-DATABASE_URL = os.getenv('DATABASE_URL')
+# SQLAlchemy and dotenv are only needed once a query runs
+sa = lazy_import('sqlalchemy')
+dotenv = lazy_import('dotenv')
 
-# creating connections
-engine = sa.create_engine(DATABASE_URL)
-connection = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+# Pool settings used when the engine is built, override them with configure_engine
+DEFAULT_ENGINE_OPTIONS = {
+    'pool_size': 5,         # connections kept open in the pool
+    'max_overflow': 10,     # extra connections allowed under load
+    'pool_timeout': 30,     # seconds to wait for a free connection
+    'pool_recycle': 1800,   # reconnect connections older than this (seconds)
+    'pool_pre_ping': True,  # test a connection on checkout and replace it if the server dropped it
+}
 
-def execute_sql_file(sql_file_path):
+# The engine is created on first use, not on import, so the module can be imported without a .env file
+_engine = None
+_engine_lock = threading.Lock()
+_database_url = None
+_engine_options = dict(DEFAULT_ENGINE_OPTIONS)
+_autocommit = True
+
+
+def configure_engine(database_url=None, autocommit=True, **engine_options):
+    """
+    Change the database URL and/or pool settings. The current engine is disposed and a new
+    one is built on next use.
+
+    :param database_url: SQLAlchemy URL, None to read DATABASE_URL from the environment / .env file.
+    :param autocommit: run connections from connect() in AUTOCOMMIT mode, turn it off for
+        databases whose driver has no isolation levels (e.g. DuckDB).
+    :param engine_options: keyword arguments for sqlalchemy.create_engine merged over
+        DEFAULT_ENGINE_OPTIONS, pass None to drop a default (e.g. pool_size=None for a
+        database whose pool does not take it).
+    """
+    global _engine, _database_url, _engine_options, _autocommit
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _database_url = database_url
+        _autocommit = autocommit
+        options = {**DEFAULT_ENGINE_OPTIONS, **engine_options}
+        _engine_options = {key: value for key, value in options.items() if value is not None}
+
+
+def get_engine():
+    """
+    Returns the shared SQLAlchemy engine, creating it on first call. Safe to call from several threads.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                database_url = _database_url
+                if database_url is None:
+                    # Get the DB URL from environment file in order execute you must have the .env file in your root folder with URL string
+                    dotenv.load_dotenv()  # This loads the .env file
+                    database_url = os.getenv('DATABASE_URL')
+                if not database_url:
+                    raise RuntimeError("DATABASE_URL is not set, add it to the .env file or call configure_engine(url)")
+                _engine = sa.create_engine(database_url, **_engine_options)
+    return _engine
+
+
+def dispose_engine():
+    """
+    Close every pooled connection, e.g. before forking worker processes.
+    """
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+
+
+@contextmanager
+def connect():
+    """
+    Check out an AUTOCOMMIT connection from the pool for the duration of a with block.
+    The connection goes back to the pool when the block exits.
+    """
+    with get_engine().connect() as connection:
+        if _autocommit:
+            connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        yield connection
+
+
+def __getattr__(name):
+    # Keep `dbs.engine` working for notebook code written against the old module level engine
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Cheap summary of the source tables, when any of these change the cached results are stale
+FINGERPRINT_QUERY = """
+SELECT
+  (SELECT COUNT(*) FROM users) AS users_rows,
+  (SELECT COUNT(*) FROM sessions) AS sessions_rows,
+  (SELECT MAX(session_end) FROM sessions) AS sessions_max_end,
+  (SELECT COUNT(*) FROM flights) AS flights_rows,
+  (SELECT COUNT(*) FROM hotels) AS hotels_rows
+"""
+
+def execute_sql_file(sql_file_path, chunksize=None, dtype=None, cache_dir=None, force_refresh=False,
+                     cache_max_bytes=cache_support.DEFAULT_MAX_BYTES, params=None, profile=False, per_cte=False,
+                     schema=None, sample=None):
     """
     Execute a SQL file  and returns the resuls as pandas Dataframe.
 
+    When chunksize is given the query is streamed through a server-side cursor and an
+    iterator of DataFrames with at most chunksize rows is returned instead, so the full
+    result set is never held in memory.
+
     :param sql_file_path: path to the SQL file.
-    :param db_connections: A Connections object to the database
+    :param chunksize: number of rows per chunk, None to load the whole result.
+    :param dtype: dict of column name to dtype applied to the result (and to every chunk).
+    :param cache_dir: folder of the on-disk result cache, None disables caching. The cache is
+        keyed by the SQL text and table_fingerprint(), so edits to the file or new rows in the
+        source tables trigger a fresh run. Not used together with chunksize.
+    :param force_refresh: ignore any cached result and re-run the query.
+    :param cache_max_bytes: size budget of the cache folder, least recently used entries are evicted.
+    :param params: dict of values for :name placeholders in the SQL file.
+    :param profile: instead of fetching the result, run the query under EXPLAIN (ANALYZE, BUFFERS)
+        and return the profiling report of src.profile_support.profile_sql.
+    :param per_cte: with profile, also run and report every CTE on its own.
+    :param schema: compact the result (and every chunk) with src.schema_support.apply_schema:
+        True for the combined user feature schema, or a dict of column name to dtype.
+    :param sample: only read a sample of the users, as a fraction (e.g. 0.05) or a dict of
+        src.sample_support.sample_query options (fraction, seed, strata_column, min_per_stratum,
+        method). The result gets a sampling_weight column for the sample_support profiling helpers.
     """
        
     #Read the SQL file
     with open(sql_file_path, 'r') as file:
         sql_query = file.read()
 
+    if sample:
+        from src import sample_support
+        options = sample if isinstance(sample, dict) else {'fraction': sample}
+        sql_query = sample_support.sample_query(sql_query, dialect=get_engine().dialect.name, **options)
+
+    if profile:
+        from src import profile_support
+        return profile_support.profile_sql(sql_query, per_cte=per_cte)
+
+    if chunksize:
+        return stream_sql_query(sql_query, chunksize, dtype=dtype, params=params, schema=schema)
+
+    if cache_dir:
+        key = cache_support.cache_key(sql_query, dtype, params, table_fingerprint())
+        if not force_refresh:
+            df = cache_support.load_cached(cache_dir, key)
+            if df is not None:
+                return _apply_schema(df, schema)
+
     #Execute the query and fetcht the result in to dataframe
-    df = pd.read_sql_query(sql_query, connection)
+    with connect() as connection:
+        df = pd.read_sql_query(_as_statement(sql_query, params), connection, params=params, dtype=dtype)
+
+    if cache_dir:
+        cache_support.store_cached(df, cache_dir, key, max_bytes=cache_max_bytes)
+
+    return _apply_schema(df, schema)
+
+def _apply_schema(df, schema):
+    if schema is None or schema is False:
+        return df
+    from src import schema_support
+    return schema_support.apply_schema(df, None if schema is True else schema)
+
+def table_fingerprint():
+    """
+    Returns row counts and the latest session_end of the source tables as a dict.
+    """
+    with connect() as connection:
+        result = pd.read_sql_query(FINGERPRINT_QUERY, connection)
+    return {column: str(value) for column, value in result.iloc[0].items()}
+
+def _as_statement(sql_query, params):
+    # Bound parameters use the :name style of sqlalchemy.text, plain strings go to the driver as is
+    return sa.text(sql_query) if params else sql_query
 
-    return df
+def stream_sql_query(sql_query, chunksize=50000, dtype=None, params=None, schema=None):
+    """
+    Run a query on a server-side cursor and yield the result as DataFrame chunks.
+
+    An AUTOCOMMIT connection cannot hold a named cursor open, so the stream checks out a
+    connection inside a transaction that lives as long as the generator.
+
+    :param sql_query: SQL query string.
+    :param chunksize: number of rows per yielded DataFrame.
+    :param dtype: dict of column name to dtype, fixed up front so every chunk has the same
+        dtypes even when a chunk happens to hold only NULLs for a column.
+    :param params: dict of values for :name placeholders in the query.
+    :param schema: see execute_sql_file. Categoricals are built per chunk, so their categories
+        can differ between chunks.
+    """
+    with get_engine().connect() as stream_connection:
+        stream_connection = stream_connection.execution_options(stream_results=True, max_row_buffer=chunksize)
+        statement = _as_statement(sql_query, params)
+        for chunk in pd.read_sql_query(statement, stream_connection, params=params, chunksize=chunksize, dtype=dtype):
+            yield _apply_schema(chunk, schema)
+
+def _read_query(query):
+    # A path to a .sql file or the SQL text itself
+    if query.strip().lower().endswith('.sql') and os.path.exists(query):
+        with open(query, 'r') as file:
+            return file.read()
+    return query
+
+def _cancel_query(connection):
+    # Ask the driver to stop the statement running on this connection, from another thread
+    dbapi_connection = connection.connection.dbapi_connection
+    for method in ('cancel', 'interrupt'):  # psycopg2 / psycopg, DuckDB and sqlite3
+        if hasattr(dbapi_connection, method):
+            getattr(dbapi_connection, method)()
+            return True
+    return False
+
+def run_queries(queries, max_workers=4, timeout=None, progress=None, cancel_event=None, dtype=None,
+                return_exceptions=False):
+    """
+    Run several SQL files or queries concurrently on pooled connections.
+
+    :param queries: dict of name to a SQL file path or SQL text, or to a (query, params) tuple
+        for :name placeholders; a list of SQL file paths is keyed by file name without .sql.
+    :param max_workers: queries running at the same time, keep it within the pool size plus
+        overflow (see DEFAULT_ENGINE_OPTIONS).
+    :param timeout: seconds a single query may run before it is cancelled on the server
+        (None for no limit). The query then fails with TimeoutError.
+    :param progress: function called as progress(name, status, seconds, finished, total) when a
+        query ends, status is 'done', 'failed', 'timeout' or 'cancelled'.
+    :param cancel_event: threading.Event, set it from another thread (or a progress callback)
+        to cancel the running queries and skip the queued ones. Ctrl+C does the same.
+    :param dtype: dict of column name to dtype applied to every result.
+    :param return_exceptions: put the exception of a failed query in the result instead of
+        raising it. By default the first failure cancels the other queries and is raised.
+    :return: dict of name to DataFrame, in the order of queries.
+    """
+    if not isinstance(queries, dict):
+        queries = {os.path.splitext(os.path.basename(query))[0]: query for query in queries}
+    cancel_event = cancel_event or threading.Event()
+    running = {}
+    running_lock = threading.Lock()
+    seconds = {}
+
+    def cancel_running():
+        with running_lock:
+            for connection in running.values():
+                _cancel_query(connection)
+
+    def run(name, query):
+        sql_query, params = query if isinstance(query, tuple) else (query, None)
+        sql_query = _read_query(sql_query)
+        if cancel_event.is_set():
+            raise CancelledError(f"query {name!r} was cancelled")
+
+        start = time.perf_counter()
+        with connect() as connection:
+            timed_out = threading.Event()
+
+            def on_timeout():
+                timed_out.set()
+                _cancel_query(connection)
+
+            timer = threading.Timer(timeout, on_timeout) if timeout else None
+            with running_lock:
+                running[name] = connection
+            try:
+                if cancel_event.is_set():
+                    raise CancelledError(f"query {name!r} was cancelled")
+                if timer:
+                    timer.start()
+                return pd.read_sql_query(_as_statement(sql_query, params), connection, params=params, dtype=dtype)
+            except Exception as error:
+                if timed_out.is_set():
+                    raise TimeoutError(f"query {name!r} did not finish within {timeout} seconds") from error
+                if cancel_event.is_set() and not isinstance(error, CancelledError):
+                    raise CancelledError(f"query {name!r} was cancelled") from error
+                raise
+            finally:
+                if timer:
+                    timer.cancel()
+                with running_lock:
+                    running.pop(name, None)
+                seconds[name] = time.perf_counter() - start
+
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(run, name, query): name for name, query in queries.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                    status = 'done'
+                except Exception as error:
+                    status = ('cancelled' if isinstance(error, CancelledError)
+                              else 'timeout' if isinstance(error, TimeoutError) else 'failed')
+                    if not return_exceptions and status != 'cancelled':
+                        cancel_event.set()
+                        raise
+                    results[name] = error
+                if progress:
+                    progress(name, status, seconds.get(name), len(results), len(queries))
+            if cancel_event.is_set():
+                for future in pending:
+                    future.cancel()
+                cancel_running()
+    except BaseException:
+        cancel_event.set()
+        for future in futures:
+            future.cancel()
+        cancel_running()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    if cancel_event.is_set() and not return_exceptions:
+        raise CancelledError("run_queries was cancelled")
+    return {name: results[name] for name in queries if name in results}
 
 def check_tables():
     """
     Checks and returns the list of table names in the database.
 
-    :param engine: SQLAlchemy engine object.
     :return: List of table names.
     """
-    inspector = sa.inspect(engine)
+    inspector = sa.inspect(get_engine())
     return inspector.get_table_names()
 
 
-def table_row_count():
-    table_counts = {}
-    inspector = sa.inspect(engine)
-    # Loop throught the table names ange get the count
-    for table in inspector.get_table_names():
-        query = f"SELECT COUNT(*) FROM {table}"
-        result = pd.read_sql_query(query, connection)
-        table_counts[table] = result.iloc[0, 0]  # Get the count from the first (and only) row
+# Planner estimates and on-disk size from the PostgreSQL catalog, no table scan needed
+ESTIMATE_STATS_QUERY = """
+SELECT
+  c.relname AS table_name,
+  c.reltuples::BIGINT AS row_estimate,
+  pg_total_relation_size(c.oid) AS total_bytes
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p')
+  AND n.nspname = current_schema()
+"""
 
-    # Print the count of records
-    for table, count in table_counts.items():
-        print(f"{table}: {count} records")
+def table_stats(tables=None, mode='exact', concurrent=False, max_workers=4):
+    """
+    Returns the row count and size of each table as a dict {table: {'rows': ..., 'bytes': ...}}.
+
+    :param tables: list of table names, None for every table in the database.
+    :param mode: 'exact' runs COUNT(*) on every table; 'estimate' reads the planner estimate
+        (pg_class.reltuples) from the catalog, which is instant but only as fresh as the last
+        ANALYZE / autovacuum. rows is None for a table that was never analyzed.
+    :param concurrent: in exact mode run one COUNT(*) per table on parallel pooled connections
+        instead of batching all counts into a single query.
+    :param max_workers: number of parallel connections for concurrent mode.
+    :return: dict keyed by table name. bytes is the total relation size (with indexes and
+        TOAST) on PostgreSQL and None on other databases.
+    """
+    if tables is None:
+        tables = check_tables()
+
+    if mode == 'estimate':
+        return _estimate_table_stats(tables)
+    if mode != 'exact':
+        raise ValueError(f"mode must be 'exact' or 'estimate', got {mode!r}")
+
+    engine = get_engine()
+    quote = engine.dialect.identifier_preparer.quote
+    with_size = engine.dialect.name == 'postgresql'
+
+    def stats_columns(position, table):
+        columns = [f"(SELECT COUNT(*) FROM {quote(table)}) AS rows_{position}"]
+        if with_size:
+            columns.append(f"pg_total_relation_size('{quote(table)}') AS bytes_{position}")
+        return columns
+
+    def run_query(columns):
+        with connect() as connection:
+            return connection.exec_driver_sql("SELECT " + ", ".join(columns)).one()
 
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            rows = list(executor.map(lambda table: run_query(stats_columns(0, table)), tables))
+    else:
+        # One round trip: a single row with a scalar sub query per table
+        columns = [column for position, table in enumerate(tables) for column in stats_columns(position, table)]
+        row = run_query(columns) if columns else ()
+        width = 2 if with_size else 1
+        rows = [row[position * width:(position + 1) * width] for position in range(len(tables))]
 
+    return {
+        table: {'rows': int(row[0]), 'bytes': int(row[1]) if with_size else None}
+        for table, row in zip(tables, rows)
+    }
 
+
+def _estimate_table_stats(tables):
+    with connect() as connection:
+        result = pd.read_sql_query(ESTIMATE_STATS_QUERY, connection)
+
+    catalog = result.set_index('table_name')
+    stats = {}
+    for table in tables:
+        if table not in catalog.index:
+            raise ValueError(f"table {table!r} not found in the current schema")
+        row_estimate = int(catalog.at[table, 'row_estimate'])
+        stats[table] = {
+            # reltuples is -1 until the table has been analyzed (PostgreSQL 14+)
+            'rows': row_estimate if row_estimate >= 0 else None,
+            'bytes': int(catalog.at[table, 'total_bytes']),
+        }
+    return stats
+
+
+def table_row_count(mode='exact'):
+    """
+    Prints the number of records in every table, use table_stats to get the counts as a dict.
+
+    :param mode: 'exact' or 'estimate', see table_stats.
+    """
+    # Print the count of records
+    for table, stats in table_stats(mode=mode).items():
+        print(f"{table}: {stats['rows']} records")
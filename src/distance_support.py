@@ -0,0 +1,94 @@
+# Import the needed libraries
+
+import os
+import numpy as np
+import pandas as pd
+from src import cache_support
+
+# Great circle distances between home and destination airports. The set of airport pairs is
+# small and fixed, so distances are computed once with a vectorized haversine and kept in a
+# lookup table on disk; the pandas feature pipeline (feature_support) joins against it instead of
+# doing trig per row. The table is a generated file, so it lives in the cache folder. The SQL path
+# (the distance CTE of All_info_combined.sql) still computes the distance on the server, the
+# lookup table is not loaded into the database.
+
+EARTH_RADIUS_KM = 6371
+DEFAULT_DISTANCE_TABLE = os.path.join(cache_support.DEFAULT_CACHE_DIR, 'airport_distances.csv')
+
+PAIR_COLUMNS = ['home_airport', 'destination_airport']
+DISTANCE_COLUMNS = PAIR_COLUMNS + ['distance_km']
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Vectorized great circle distance in km between arrays of coordinates in degrees.
+    Equal to the spherical law of cosines used in All_info_combined.sql but numerically
+    stable for short distances.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def load_distance_table(path=DEFAULT_DISTANCE_TABLE):
+    """
+    Load the airport pair distance table, empty when the file does not exist yet.
+    """
+    if not path or not os.path.exists(path):
+        return pd.DataFrame({'home_airport': pd.Series(dtype=str), 'destination_airport': pd.Series(dtype=str),
+                             'distance_km': pd.Series(dtype=float)})
+    return pd.read_csv(path)
+
+
+def build_distances(pairs):
+    """
+    Distances for airport pairs.
+
+    Parameters:
+    - pairs (pd.DataFrame): home_airport, destination_airport, home_airport_lat, home_airport_lon,
+      destination_airport_lat and destination_airport_lon columns.
+
+    Returns:
+    - pd.DataFrame with home_airport, destination_airport and distance_km, one row per pair.
+    """
+    pairs = pairs.drop_duplicates(PAIR_COLUMNS)
+    distances = pairs[PAIR_COLUMNS].copy()
+    distances['distance_km'] = haversine_km(
+        pairs['home_airport_lat'], pairs['home_airport_lon'],
+        pairs['destination_airport_lat'], pairs['destination_airport_lon'],
+    )
+    return distances.reset_index(drop=True)
+
+
+def update_distance_table(pairs, path=DEFAULT_DISTANCE_TABLE):
+    """
+    Add the pairs missing from the lookup table and save it. Only new pairs are computed.
+
+    Parameters:
+    - pairs (pd.DataFrame): see build_distances.
+    - path (str): CSV file of the lookup table, None to keep it in memory only.
+
+    Returns:
+    - the complete lookup table.
+    """
+    table = load_distance_table(path)
+    pairs = pairs.dropna(subset=PAIR_COLUMNS)
+    known = pd.MultiIndex.from_frame(table[PAIR_COLUMNS])
+    new_pairs = pairs[~pd.MultiIndex.from_frame(pairs[PAIR_COLUMNS]).isin(known)]
+    if new_pairs.empty:
+        return table
+
+    table = pd.concat([table, build_distances(new_pairs)], ignore_index=True)
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        table.to_csv(path, index=False)
+    return table
+
+
+def lookup_distances(pairs, table):
+    """
+    Distance of each row of pairs (home_airport, destination_airport), aligned with pairs.index.
+    Pairs not in the table get NaN.
+    """
+    merged = pairs[PAIR_COLUMNS].merge(table[DISTANCE_COLUMNS], on=PAIR_COLUMNS, how='left')
+    return pd.Series(merged['distance_km'].to_numpy(), index=pairs.index)
@@ -0,0 +1,114 @@
+# Import the needed libraries
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from src.lazy_support import lazy_import
+
+# Batch export of the plot_support figures to static images. Build the figures with show=False,
+# collect them in a dict {name: figure} and export them together: figures whose spec did not
+# change since the last export are skipped (the hash is kept in a manifest next to the images),
+# the others are split over a few worker processes that each render their whole batch with one
+# kaleido session instead of starting a renderer per figure.
+
+MANIFEST_NAME = 'manifest.json'
+
+pio = lazy_import('plotly.io')
+
+
+def figure_hash(fig, fmt='png', width=None, height=None, scale=1):
+    """
+    Hash of a figure spec and the export settings, equal hashes give identical images.
+    """
+    settings = json.dumps({'format': fmt, 'width': width, 'height': height, 'scale': scale}, sort_keys=True)
+    digest = hashlib.sha256(fig.to_json().encode('utf-8'))
+    digest.update(settings.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_manifest(out_dir):
+    """
+    Hashes of the images already exported to out_dir, {file name: hash}.
+    """
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def _save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _render_batch(figures, paths, fmt, width, height, scale):
+    # Runs in a worker process: one call renders the whole batch with a single kaleido session
+    try:
+        pio.write_images(figures, paths, format=fmt, width=width, height=height, scale=scale)
+    except AttributeError:
+        # Older plotly without write_images
+        for fig, path in zip(figures, paths):
+            pio.write_image(fig, path, format=fmt, width=width, height=height, scale=scale)
+    return paths
+
+
+def export_figures(figures, out_dir='figures', fmt='png', workers=4, width=None, height=None, scale=1, force=False):
+    """
+    Export figures to static images, skipping the ones already on disk with the same spec.
+
+    Parameters:
+    - figures (dict): {name: plotly figure}, e.g. built with the plot_support functions and show=False.
+      The name becomes the file name, '<name>.<fmt>'.
+    - out_dir (str): folder for the images and the manifest, created if missing.
+    - fmt (str): image format supported by kaleido (png, svg, pdf, jpeg, webp).
+    - workers (int): worker processes, each one renders its share of the figures with one
+      renderer. 1 renders in this process.
+    - width, height, scale: image size settings passed to kaleido.
+    - force (bool): export every figure even when its image is up to date.
+
+    Returns:
+    - dict with 'written' and 'skipped', lists of the image paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+
+    pending = []
+    skipped = []
+    hashes = {}
+    for name, fig in figures.items():
+        file_name = f'{name}.{fmt}'
+        path = os.path.join(out_dir, file_name)
+        hashes[file_name] = figure_hash(fig, fmt, width, height, scale)
+        if not force and manifest.get(file_name) == hashes[file_name] and os.path.exists(path):
+            skipped.append(path)
+        else:
+            pending.append((file_name, fig, path))
+
+    written = []
+    if pending:
+        workers = max(1, min(workers or 1, len(pending)))
+        batches = [pending[worker::workers] for worker in range(workers)]
+        if workers == 1:
+            _render_batch([fig for _, fig, _ in pending], [path for _, _, path in pending], fmt, width, height, scale)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_render_batch, [fig for _, fig, _ in batch], [path for _, _, path in batch],
+                                    fmt, width, height, scale)
+                    for batch in batches
+                ]
+                for future in futures:
+                    future.result()
+
+        # Only record the hashes once the images exist, a failed run is exported again next time
+        for file_name, _, path in pending:
+            manifest[file_name] = hashes[file_name]
+            written.append(path)
+        _save_manifest(out_dir, manifest)
+
+    return {'written': written, 'skipped': skipped}
@@ -0,0 +1,492 @@
+# Import the needed libraries
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from src import db_support as dbs
+from src import distance_support
+
+# Python version of SQL/All_info_combined.sql. The per user metrics are rebuilt from the raw
+# session rows of SQL/All_Data.sql with vectorized group-by aggregations, so the heavy query
+# does not have to run on the warehouse.
+#
+# The raw rows are first reduced to mergeable partial aggregates per user (sums, counts, max and
+# the distinct cancelled trips / flown routes). Partials of different chunks are merged, which is
+# how inputs larger than memory are handled, and only then turned into the final ratios and the
+# global min-max scaled columns.
+
+ALL_DATA_SQL = os.path.join('SQL', 'All_Data.sql')
+SESSIONS_SINCE_SQL = os.path.join('SQL', 'Sessions_Since.sql')
+
+# Folder of the incremental refresh state (partial aggregates, unscaled metrics and watermark)
+DEFAULT_STATE_DIR = 'feature_state'
+# Watermark of an empty state, older than any session
+INITIAL_WATERMARK = '1900-01-01 00:00:00'
+
+# Same cohort rule as the UserSessions CTE: more than 7 sessions started on or after this date
+COHORT_START = '2023-01-04'
+COHORT_MIN_SESSIONS = 7
+
+# Columns of the partial aggregates and how two partials of the same user are merged
+SUM_COLUMNS = [
+    'sessions', 'qualifying_sessions', 'trips', 'only_flights', 'only_hotels', 'together',
+    'flight_discount_sessions', 'hotel_discount_sessions', 'both_discount_sessions',
+    'clicks_sum', 'flight_discount_sum', 'flight_discount_count', 'hotel_discount_sum',
+    'hotel_discount_count', 'checked_bags_sum', 'checked_bags_count', 'clipped_nights_sum',
+    'nights_count', 'total_nights_sum', 'hotel_cost_sum', 'hotel_cost_count', 'flight_spend_sum',
+]
+MAX_COLUMNS = ['latest_session']
+PROFILE_COLUMNS = [
+    'birthdate', 'gender', 'married', 'has_children', 'home_country', 'home_city',
+    'home_airport', 'home_airport_lat', 'home_airport_lon',
+]
+ROUTE_COLUMNS = ['origin_airport', 'destination_airport', 'destination_airport_lat', 'destination_airport_lon']
+
+# Output columns, in the order of the FinalQuery CTE plus the notebook's flight_hunter_index
+FEATURE_COLUMNS = [
+    'user_id', 'birthdate', 'gender', 'married', 'has_children', 'home_country', 'home_city',
+    'age', 'age_group', 'latest_session', 'total_trips', 'total_cancellations', 'total_sessions',
+    'total_cancellation_rate', 'average_checked_bags', 'prefers_flights', 'prefers_hotels',
+    'prefers_both', 'conversion_rate', 'average_clicks', 'total_clicks', 'click_efficiency',
+    'average_hotel_discount', 'average_flight_discount', 'flight_discount_proportion',
+    'hotel_discount_proportion', 'both_discount_proportion', 'discount_responsiveness',
+    'total_hotel_usd_spent', 'total_flight_usd_spent', 'total_usd_spent', 'total_nights',
+    'avg_nights', 'scaled_hotel_ads', 'ads_per_km', 'scaled_ads_per_km', 'hotel_hunter_index',
+    'flight_hunter_index',
+]
+
+AGE_GROUPS = [(15, 17), (18, 24), (25, 34), (35, 44), (45, 54), (55, 64)]
+
+
+def _is_true(series):
+    # SQL three valued logic: NULL never matches `= TRUE` / `= FALSE`
+    return series.eq(True).fillna(False).astype(bool)
+
+
+def _is_false(series):
+    return series.eq(False).fillna(False).astype(bool)
+
+
+def _numeric(series):
+    # Nullable Int64 / Float64 columns from the driver become plain float64 with NaN for NULL
+    return pd.to_numeric(series).astype(float)
+
+
+def partial_aggregates(sessions):
+    """
+    Reduce raw session rows (the All_Data.sql columns) to mergeable per user partial aggregates.
+
+    Parameters:
+    - sessions (pd.DataFrame): one row per session with the flight / hotel columns joined in.
+
+    Returns:
+    - dict with 'users' (one row per user_id of sums, counts, max and profile columns),
+      'cancellations' (distinct user_id, trip_id of cancelled trips) and
+      'routes' (distinct flown routes per user).
+    """
+    has_trip = sessions['trip_id'].notna()
+    has_flight = sessions['origin_airport'].notna()
+    has_hotel = sessions['hotel_name'].notna()
+    flight_discount = _is_true(sessions['flight_discount'])
+    hotel_discount = _is_true(sessions['hotel_discount'])
+    flight_booked = _is_true(sessions['flight_booked'])
+    hotel_booked = _is_true(sessions['hotel_booked'])
+    flight_discount_amount = _numeric(sessions['flight_discount_amount'])
+    hotel_discount_amount = _numeric(sessions['hotel_discount_amount'])
+    nights = _numeric(sessions['nights'])
+    checked_bags = _numeric(sessions['checked_bags'])
+
+    if 'session_start' in sessions:
+        qualifying = pd.to_datetime(sessions['session_start']) >= pd.Timestamp(COHORT_START)
+    else:
+        qualifying = pd.Series(True, index=sessions.index)
+
+    # Spend per session before the user level total_nights factor (see UserTravelSpendSummary)
+    hotel_factor = np.where(hotel_discount, 1 - hotel_discount_amount, 1)
+    hotel_cost = _numeric(sessions['hotel_per_room_usd']) * hotel_factor * _numeric(sessions['rooms'])
+    hotel_cost = hotel_cost.where(has_hotel)
+    flight_factor = np.where(flight_discount, 1 - flight_discount_amount, 1)
+    flight_spend = (_numeric(sessions['base_fare_usd']) * flight_factor).where(has_flight)
+
+    parts = pd.DataFrame({
+        'user_id': sessions['user_id'],
+        'sessions': 1,
+        'qualifying_sessions': qualifying.astype(int),
+        'trips': has_trip.astype(int),
+        'only_flights': (has_trip & flight_booked & _is_false(sessions['hotel_booked'])).astype(int),
+        'only_hotels': (has_trip & hotel_booked & _is_false(sessions['flight_booked'])).astype(int),
+        'together': (has_trip & hotel_booked & flight_booked).astype(int),
+        'flight_discount_sessions': (flight_discount & (flight_discount_amount > 0)
+                                     & _is_false(sessions['hotel_discount'])).astype(int),
+        'hotel_discount_sessions': (hotel_discount & (hotel_discount_amount > 0)
+                                    & _is_false(sessions['flight_discount'])).astype(int),
+        'both_discount_sessions': (flight_discount & (flight_discount_amount > 0)
+                                   & hotel_discount & (hotel_discount_amount > 0)).astype(int),
+        'clicks_sum': sessions['page_clicks'],
+        'flight_discount_sum': flight_discount_amount.fillna(0),
+        'flight_discount_count': flight_discount_amount.notna().astype(int),
+        'hotel_discount_sum': hotel_discount_amount.fillna(0),
+        'hotel_discount_count': hotel_discount_amount.notna().astype(int),
+        'checked_bags_sum': checked_bags.fillna(0),
+        'checked_bags_count': checked_bags.notna().astype(int),
+        'clipped_nights_sum': nights.clip(lower=0).fillna(0),
+        'nights_count': nights.notna().astype(int),
+        # UserNightsSummary counts a negative stay as 1 night in the total but 0 in the average
+        'total_nights_sum': nights.where(nights >= 0, 1).where(nights.notna()).fillna(0),
+        'hotel_cost_sum': hotel_cost.fillna(0),
+        'hotel_cost_count': hotel_cost.notna().astype(int),
+        'flight_spend_sum': flight_spend.fillna(0),
+        'latest_session': pd.to_datetime(sessions['session_end']).dt.normalize(),
+    })
+    grouped = parts.groupby('user_id', sort=False)
+    users = grouped[SUM_COLUMNS].sum().join(grouped[MAX_COLUMNS].max())
+    users = users.join(sessions.groupby('user_id', sort=False)[PROFILE_COLUMNS].first())
+
+    cancelled = _is_true(sessions['cancellation']) & has_trip
+    cancellations = sessions.loc[cancelled, ['user_id', 'trip_id']].drop_duplicates()
+
+    routes = sessions.loc[has_flight, ['user_id'] + ROUTE_COLUMNS].drop_duplicates()
+
+    return {'users': users, 'cancellations': cancellations, 'routes': routes}
+
+
+def merge_partials(*partials):
+    """
+    Merge partial aggregates (from partial_aggregates or earlier merges) into one.
+    Rows of the same user found in several partials are combined.
+    """
+    users = pd.concat([part['users'] for part in partials])
+    if users.index.has_duplicates:
+        grouped = users.groupby(level=0, sort=False)
+        users = grouped[SUM_COLUMNS].sum().join(grouped[MAX_COLUMNS].max()).join(grouped[PROFILE_COLUMNS].first())
+
+    return {
+        'users': users,
+        'cancellations': pd.concat([part['cancellations'] for part in partials]).drop_duplicates(),
+        'routes': pd.concat([part['routes'] for part in partials]).drop_duplicates(),
+    }
+
+
+def merge_stream(partials):
+    """
+    Merge a stream of partial aggregates (e.g. one per chunk), None for an empty stream.
+
+    The partials are collected and merged only once the collected rows outgrow the merged
+    result, which therefore at least doubles on every merge: the total work stays linear in the
+    input instead of growing with the square of the number of chunks. With chunks ordered by
+    user_id (All_Data.sql) the partials barely overlap and a merge is mostly a concatenation.
+    """
+    def rows(part):
+        return sum(len(frame) for frame in part.values())
+
+    merged, merged_rows = [], 0
+    pending, pending_rows = [], 0
+    for part in partials:
+        pending.append(part)
+        pending_rows += rows(part)
+        if pending_rows > merged_rows:
+            merged = [merge_partials(*merged, *pending)]
+            merged_rows = rows(merged[0])
+            pending, pending_rows = [], 0
+    if pending:
+        merged = [merge_partials(*merged, *pending)]
+    return merged[0] if merged else None
+
+
+def route_distances(routes, users, distance_table_path=distance_support.DEFAULT_DISTANCE_TABLE):
+    """
+    Great circle distance in km from the user's home airport to each route's destination.
+    Distances come from the airport pair lookup table; pairs not in it yet are computed once
+    and added to the table.
+    """
+    home = users.loc[routes['user_id'], ['home_airport', 'home_airport_lat', 'home_airport_lon']]
+    pairs = routes[['destination_airport', 'destination_airport_lat', 'destination_airport_lon']].assign(
+        home_airport=home['home_airport'].to_numpy(),
+        home_airport_lat=home['home_airport_lat'].to_numpy(),
+        home_airport_lon=home['home_airport_lon'].to_numpy(),
+    )
+    table = distance_support.update_distance_table(pairs, distance_table_path)
+    return distance_support.lookup_distances(pairs, table)
+
+
+def user_metrics(partials, distance_table_path=distance_support.DEFAULT_DISTANCE_TABLE):
+    """
+    Per user metrics from merged partial aggregates, before the cohort wide scaling.
+    Only users of the cohort (more than 7 qualifying sessions) are returned. distance_table_path
+    is the airport pair distance lookup (None keeps it in memory only).
+    """
+    users = partials['users']
+    users = users[users['qualifying_sessions'] > COHORT_MIN_SESSIONS]
+    metrics = users[PROFILE_COLUMNS + MAX_COLUMNS].copy()
+
+    def ratio(numerator, denominator):
+        # COALESCE(x / NULLIF(y, 0), 0)
+        return (numerator / denominator.where(denominator != 0)).fillna(0)
+
+    trips = users['trips']
+    sessions = users['sessions']
+    cancellations = partials['cancellations'].groupby('user_id').size()
+
+    metrics['total_trips'] = trips
+    metrics['total_cancellations'] = cancellations.reindex(users.index, fill_value=0)
+    metrics['total_sessions'] = sessions
+    metrics['total_cancellation_rate'] = ratio(metrics['total_cancellations'], trips)
+    metrics['average_checked_bags'] = ratio(users['checked_bags_sum'], users['checked_bags_count'])
+    metrics['prefers_flights'] = ratio(users['only_flights'], trips)
+    metrics['prefers_hotels'] = ratio(users['only_hotels'], trips)
+    metrics['prefers_both'] = ratio(users['together'], trips)
+    metrics['conversion_rate'] = ratio(trips, sessions)
+    metrics['average_clicks'] = users['clicks_sum'] / sessions
+    metrics['total_clicks'] = users['clicks_sum']
+    metrics['click_efficiency'] = ratio(users['clicks_sum'], trips)
+    metrics['average_hotel_discount'] = ratio(users['hotel_discount_sum'], users['hotel_discount_count'])
+    metrics['average_flight_discount'] = ratio(users['flight_discount_sum'], users['flight_discount_count'])
+    metrics['flight_discount_proportion'] = users['flight_discount_sessions'] / sessions
+    metrics['hotel_discount_proportion'] = users['hotel_discount_sessions'] / sessions
+    metrics['both_discount_proportion'] = users['both_discount_sessions'] / sessions
+    metrics['discount_responsiveness'] = ratio(
+        metrics['flight_discount_proportion'] * users['only_flights']
+        + metrics['hotel_discount_proportion'] * users['only_hotels']
+        + metrics['both_discount_proportion'] * users['together'],
+        trips,
+    )
+
+    # total_nights stays NULL for users without a hotel stay, like SUM in the SQL
+    total_nights = users['total_nights_sum'].where(users['nights_count'] > 0)
+    hotel_spend = total_nights * users['hotel_cost_sum']
+    metrics['ads_hotel'] = hotel_spend / users['hotel_cost_count'].where(users['hotel_cost_count'] > 0)
+    metrics['total_hotel_usd_spent'] = hotel_spend.where(users['hotel_cost_count'] > 0).fillna(0)
+    metrics['total_flight_usd_spent'] = users['flight_spend_sum']
+    metrics['total_usd_spent'] = metrics['total_hotel_usd_spent'] + metrics['total_flight_usd_spent']
+    metrics['total_nights'] = total_nights
+    metrics['avg_nights'] = ratio(users['clipped_nights_sum'], users['nights_count'])
+
+    # distance_metrics joins every distinct route with every session of the user, so both sums
+    # are multiplied by the other side's row count before the division
+    routes = partials['routes']
+    routes = routes[routes['user_id'].isin(users.index)]
+    route_summary = (routes.assign(distance_km=route_distances(routes, users, distance_table_path))
+                     .groupby('user_id')['distance_km'].agg(['size', 'sum']))
+    route_count = route_summary['size'].reindex(users.index)
+    discount_total = (route_count * users['flight_discount_sum']).where(users['flight_discount_count'] > 0)
+    distance_total = route_summary['sum'].reindex(users.index) * sessions
+    metrics['ads_per_km'] = ratio(discount_total, distance_total)
+    metrics['has_route'] = route_count.notna()
+
+    metrics.index.name = 'user_id'
+    return metrics
+
+
+def _min_max(values):
+    # COALESCE((x - MIN(x)) / NULLIF(MAX(x) - MIN(x), 0), 0)
+    spread = values.max() - values.min()
+    if not spread or np.isnan(spread):
+        return pd.Series(0.0, index=values.index)
+    return ((values - values.min()) / spread).fillna(0)
+
+
+def age_in_years(birthdate, now=None):
+    """
+    Completed years between birthdate and now, like EXTRACT(YEAR FROM AGE(NOW(), birthdate)).
+    """
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    birthdate = pd.to_datetime(birthdate)
+    before_birthday = (birthdate.dt.month > now.month) | ((birthdate.dt.month == now.month) & (birthdate.dt.day > now.day))
+    return (now.year - birthdate.dt.year - before_birthday.astype(int)).astype(float)
+
+
+def finish_features(metrics, now=None):
+    """
+    Turn user_metrics into the final feature table: age, age_group, the min-max scaled columns
+    (scaled over the whole cohort) and the hunter indices, in FEATURE_COLUMNS order.
+    """
+    features = metrics.copy()
+    features['age'] = age_in_years(features['birthdate'], now)
+    conditions = [features['age'].between(low, high) for low, high in AGE_GROUPS]
+    features['age_group'] = np.select(conditions, [f'{low}-{high}' for low, high in AGE_GROUPS], default='65+')
+
+    features['scaled_hotel_ads'] = _min_max(features['ads_hotel'])
+    features['scaled_ads_per_km'] = _min_max(features.loc[features['has_route'], 'ads_per_km']).reindex(features.index, fill_value=0)
+    features['hotel_hunter_index'] = (features['scaled_hotel_ads'] * features['hotel_discount_proportion']
+                                      * features['average_hotel_discount'])
+    features['flight_hunter_index'] = (features['scaled_ads_per_km'] * features['flight_discount_proportion']
+                                       * features['average_flight_discount'])
+
+    return features.sort_index().reset_index()[FEATURE_COLUMNS]
+
+
+def compute_features(sessions, now=None, distance_table_path=distance_support.DEFAULT_DISTANCE_TABLE):
+    """
+    Compute the All_info_combined.sql feature table from raw All_Data.sql rows.
+
+    Parameters:
+    - sessions: a DataFrame of raw rows, or an iterable of DataFrame chunks (e.g. from
+      dbs.execute_sql_file(..., chunksize=...)). Only the per user partial aggregates of the
+      chunks are kept in memory, never the raw rows.
+    - now: reference time for the age columns (default: current time, like NOW()).
+    - distance_table_path: airport pair distance lookup file, None to keep it in memory only.
+
+    Returns:
+    - pd.DataFrame with FEATURE_COLUMNS, one row per user, ordered by user_id.
+    """
+    if isinstance(sessions, pd.DataFrame):
+        sessions = [sessions]
+
+    partials = merge_stream(partial_aggregates(chunk) for chunk in sessions)
+    if partials is None:
+        raise ValueError("no session rows to compute features from")
+
+    return finish_features(user_metrics(partials, distance_table_path), now)
+
+
+def compute_features_from_sql(sql_file_path=ALL_DATA_SQL, chunksize=200000, now=None,
+                              distance_table_path=distance_support.DEFAULT_DISTANCE_TABLE):
+    """
+    Stream the raw extract from the database in chunks and compute the feature table.
+    """
+    chunks = dbs.execute_sql_file(sql_file_path, chunksize=chunksize)
+    return compute_features(chunks, now, distance_table_path)
+
+
+def _state_files(state_dir):
+    return {
+        'users': os.path.join(state_dir, 'partial_users.parquet'),
+        'cancellations': os.path.join(state_dir, 'partial_cancellations.parquet'),
+        'routes': os.path.join(state_dir, 'partial_routes.parquet'),
+        'metrics': os.path.join(state_dir, 'user_metrics.parquet'),
+        'watermark': os.path.join(state_dir, 'watermark.json'),
+    }
+
+
+def load_state(state_dir=DEFAULT_STATE_DIR):
+    """
+    Load the incremental refresh state, or return None when the folder has no state yet.
+    """
+    files = _state_files(state_dir)
+    if not os.path.exists(files['watermark']):
+        return None
+
+    with open(files['watermark'], 'r') as file:
+        watermark = json.load(file)['session_end']
+    partials = {name: pd.read_parquet(files[name]) for name in ('users', 'cancellations', 'routes')}
+    return {'partials': partials, 'metrics': pd.read_parquet(files['metrics']), 'watermark': watermark}
+
+
+def save_state(state, state_dir=DEFAULT_STATE_DIR):
+    os.makedirs(state_dir, exist_ok=True)
+    files = _state_files(state_dir)
+    for name, frame in state['partials'].items():
+        frame.to_parquet(files[name])
+    state['metrics'].to_parquet(files['metrics'])
+    # The watermark is written last, so an interrupted save is redone from the old watermark
+    with open(files['watermark'], 'w') as file:
+        json.dump({'session_end': state['watermark']}, file)
+
+
+def _select_users(partials, user_ids):
+    return {
+        'users': partials['users'].loc[partials['users'].index.isin(user_ids)],
+        'cancellations': partials['cancellations'][partials['cancellations']['user_id'].isin(user_ids)],
+        'routes': partials['routes'][partials['routes']['user_id'].isin(user_ids)],
+    }
+
+
+def refresh_features(state_dir=DEFAULT_STATE_DIR, sql_file_path=SESSIONS_SINCE_SQL, chunksize=200000,
+                     now=None, full=False, distance_table_path=distance_support.DEFAULT_DISTANCE_TABLE):
+    """
+    Incrementally refresh the feature table from sessions that ended after the stored watermark.
+
+    The state keeps the mergeable partial aggregates of every user (not only the cohort, so users
+    who reach the cohort threshold later are complete) and the unscaled per user metrics. Only
+    the rows of users with new sessions are merged and recomputed; the cohort wide min-max
+    scaling, age and hunter indices are then redone for the whole table by finish_features.
+
+    Sessions that arrive late with a session_end at or before the watermark are not picked up,
+    run with full=True to rebuild the state from scratch.
+
+    Parameters:
+    - state_dir (str): folder of the refresh state, created on the first run.
+    - sql_file_path (str): raw session query with a :watermark parameter.
+    - chunksize (int): rows per streamed chunk.
+    - now: reference time for the age columns.
+    - full (bool): ignore the stored state and rebuild from every session.
+    - distance_table_path (str): airport pair distance lookup file.
+
+    Returns:
+    - tuple (features, updated_user_ids): the full feature table and the users whose rows changed.
+    """
+    state = None if full else load_state(state_dir)
+    watermark = state['watermark'] if state else INITIAL_WATERMARK
+
+    new_watermark = pd.Timestamp(watermark)
+
+    def new_chunk_partials():
+        nonlocal new_watermark
+        for chunk in dbs.execute_sql_file(sql_file_path, chunksize=chunksize, params={'watermark': watermark}):
+            # The database may compare with a less precise watermark (e.g. microseconds against a
+            # nanosecond column), drop the rows it already counted at the full precision
+            session_end = pd.to_datetime(chunk['session_end'])
+            chunk = chunk[(session_end > pd.Timestamp(watermark)).to_numpy()]
+            if not chunk.empty:
+                new_watermark = max(new_watermark, session_end.max())
+                yield partial_aggregates(chunk)
+
+    new_partials = merge_stream(new_chunk_partials())
+
+    if new_partials is None:
+        if state is None:
+            raise ValueError("no session rows to compute features from")
+        return finish_features(state['metrics'], now), pd.Index([], name='user_id')
+
+    updated_users = new_partials['users'].index
+    if state is None:
+        partials = new_partials
+        metrics = user_metrics(partials, distance_table_path)
+    else:
+        old = state['partials']
+        affected = merge_partials(_select_users(old, updated_users), new_partials)
+        partials = {
+            'users': pd.concat([old['users'].loc[~old['users'].index.isin(updated_users)], affected['users']]),
+            'cancellations': pd.concat([old['cancellations'], new_partials['cancellations']]).drop_duplicates(),
+            'routes': pd.concat([old['routes'], new_partials['routes']]).drop_duplicates(),
+        }
+        affected_metrics = user_metrics(affected, distance_table_path)
+        metrics = pd.concat([state['metrics'].loc[~state['metrics'].index.isin(updated_users)], affected_metrics])
+
+    save_state({'partials': partials, 'metrics': metrics, 'watermark': str(new_watermark)}, state_dir)
+    return finish_features(metrics, now), updated_users
+
+
+def compare_features(features, expected, rtol=1e-9, atol=1e-12):
+    """
+    Compare two feature tables column for column, e.g. compute_features output against the
+    All_info_combined.sql result.
+
+    Returns:
+    - pd.DataFrame with one row per shared column: number of mismatching users and the largest
+      absolute difference for numeric columns. Users present in only one table are counted in
+      the 'missing_users' row.
+    """
+    left = features.set_index('user_id')
+    right = expected.set_index('user_id')
+    users = left.index.intersection(right.index)
+    left, right = left.loc[users], right.loc[users]
+
+    report = []
+    for column in [column for column in left.columns if column in right.columns]:
+        ours, theirs = left[column], right[column]
+        if pd.api.types.is_numeric_dtype(ours) and pd.api.types.is_numeric_dtype(theirs):
+            ours, theirs = ours.astype(float), theirs.astype(float)
+            matches = np.isclose(ours, theirs, rtol=rtol, atol=atol, equal_nan=True)
+            max_difference = float(np.nanmax(np.abs(ours - theirs))) if len(users) else 0.0
+        else:
+            if column in ('birthdate', 'latest_session'):
+                ours, theirs = pd.to_datetime(ours), pd.to_datetime(theirs)
+            matches = (ours == theirs) | (ours.isna() & theirs.isna())
+            max_difference = np.nan
+        report.append({'column': column, 'mismatches': int((~np.asarray(matches)).sum()), 'max_abs_difference': max_difference})
+
+    missing = len(features.index) + len(expected.index) - 2 * len(users)
+    report.append({'column': 'missing_users', 'mismatches': missing, 'max_abs_difference': np.nan})
+    return pd.DataFrame(report)
@@ -0,0 +1,281 @@
+# Import the needed libraries
+
+import functools
+import importlib
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import pandas as pd
+
+# Opt-in instrumentation of the public functions of db_support, plot_support and cus_support.
+# enable() swaps every public function of these modules for a wrapper that records wall time,
+# rows and bytes of the DataFrames it returns (streamed chunks included), the tracemalloc peak
+# during the call and the JSON size of the figures it returns or shows (plotly's
+# BaseFigure.show is patched while enabled, charts drawn with show=True return nothing).
+# disable() puts the originals back.
+# The events go to a JSON lines log (one line per call, tagged with the run id, so nightly runs
+# can be compared) and to a Chrome trace file (open it in chrome://tracing or Perfetto).
+
+DEFAULT_MODULES = ['src.db_support', 'src.plot_support', 'src.cus_support']
+DEFAULT_LOG_DIR = 'instrumentation'
+
+_originals = {}
+_recorder = None
+_local = threading.local()
+
+
+class Recorder:
+    """
+    Collected call events of one run.
+
+    Parameters:
+    - run_id (str): tag of the run in the log, default the start time (UTC).
+    - trace_memory (bool): measure the peak memory of every call with tracemalloc (slows
+      allocations down noticeably). tracemalloc is process wide, so calls running at the same
+      time in other threads add to each other's peaks.
+    """
+
+    def __init__(self, run_id=None, trace_memory=True):
+        self.run_id = run_id or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        self.trace_memory = trace_memory
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def add(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self):
+        """
+        Calls, total and max wall time, rows, bytes and peak memory per function.
+        """
+        events = pd.DataFrame(self.events)
+        if events.empty:
+            return events
+        return events.groupby('name').agg(
+            calls=('name', 'size'),
+            total_ms=('wall_ms', 'sum'),
+            max_ms=('wall_ms', 'max'),
+            rows=('rows', 'sum'),
+            bytes=('bytes', 'sum'),
+            peak_memory_bytes=('peak_memory_bytes', 'max'),
+            figure_bytes=('figure_bytes', 'sum'),
+        ).sort_values('total_ms', ascending=False)
+
+    def write_log(self, path):
+        """
+        Append the events to a JSON lines file, returns the path.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a') as file:
+            for event in self.events:
+                file.write(json.dumps({'run_id': self.run_id, **event}, default=str) + '\n')
+        return path
+
+    def write_chrome_trace(self, path):
+        """
+        Write the events in the Chrome trace event format, returns the path.
+        """
+        trace_events = [{
+            'name': event['name'],
+            'cat': event['module'],
+            'ph': 'X',
+            'ts': event['start_us'],
+            'dur': event['wall_ms'] * 1000,
+            'pid': os.getpid(),
+            'tid': event['thread'],
+            'args': {key: event[key] for key in ('rows', 'bytes', 'peak_memory_bytes', 'figure_bytes', 'error')
+                     if event.get(key) is not None},
+        } for event in self.events]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace_events, 'metadata': {'run_id': self.run_id}}, file)
+        return path
+
+
+def _measure(result):
+    # rows and bytes of DataFrame results (a dict of DataFrames counts them all), JSON size of figures
+    frames = [result] if isinstance(result, pd.DataFrame) else []
+    if isinstance(result, dict):
+        frames = [value for value in result.values() if isinstance(value, pd.DataFrame)]
+    measures = {'rows': None, 'bytes': None, 'figure_bytes': None}
+    if frames:
+        measures['rows'] = sum(len(frame) for frame in frames)
+        measures['bytes'] = int(sum(frame.memory_usage(deep=True).sum() for frame in frames))
+    elif hasattr(result, 'to_plotly_json'):
+        measures['figure_bytes'] = len(result.to_json())
+    return measures
+
+
+def _show(figure, *args, **kwargs):
+    # BaseFigure.show while enabled: the JSON size goes to the innermost instrumented call
+    shown = getattr(_local, 'shown', None)
+    if shown:
+        shown[-1] += len(figure.to_json())
+    return _originals[(_figure_class(), 'show')](figure, *args, **kwargs)
+
+
+def _figure_class():
+    return importlib.import_module('plotly.basedatatypes').BaseFigure
+
+
+def _start_memory(recorder):
+    if not recorder.trace_memory:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    # The peak of an outer call must include its nested calls, which reset the peak
+    stack = getattr(_local, 'peaks', None)
+    if stack is None:
+        stack = _local.peaks = []
+    if stack:
+        stack[-1] = max(stack[-1], tracemalloc.get_traced_memory()[1])
+    stack.append(0)
+    tracemalloc.reset_peak()
+
+
+def _stop_memory(recorder):
+    if not recorder.trace_memory:
+        return None
+    stack = _local.peaks
+    peak = max(stack.pop(), tracemalloc.get_traced_memory()[1])
+    if stack:
+        stack[-1] = max(stack[-1], peak)
+    tracemalloc.reset_peak()
+    return peak
+
+
+def _record(recorder, func, start, peak, measures, error):
+    recorder.add({
+        'name': func.__qualname__,
+        'module': func.__module__,
+        'start_us': (start - recorder._origin) * 1e6,
+        'wall_ms': (time.perf_counter() - start) * 1000,
+        'thread': threading.get_ident(),
+        'peak_memory_bytes': peak,
+        **measures,
+        'error': error,
+    })
+
+
+def _stream(recorder, func, chunks, start):
+    # Generators run when they are consumed: time, rows and bytes cover the whole stream
+    measures = {'rows': 0, 'bytes': 0, 'figure_bytes': None}
+    error = None
+    try:
+        for chunk in chunks:
+            chunk_measures = _measure(chunk)
+            measures['rows'] += chunk_measures['rows'] or 0
+            measures['bytes'] += chunk_measures['bytes'] or 0
+            yield chunk
+    except Exception as exception:
+        error = repr(exception)
+        raise
+    finally:
+        _record(recorder, func, start, None, measures, error)
+
+
+def _wrap(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = _recorder
+        if recorder is None:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter()
+        _start_memory(recorder)
+        shown = getattr(_local, 'shown', None)
+        if shown is None:
+            shown = _local.shown = []
+        shown.append(0)
+        error = None
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return _stream(recorder, func, result, start) if inspect.isgenerator(result) else result
+        except Exception as exception:
+            error = repr(exception)
+            raise
+        finally:
+            peak = _stop_memory(recorder)
+            shown_bytes = shown.pop()
+            if not inspect.isgenerator(result):
+                measures = _measure(result)
+                if measures['figure_bytes'] is None and shown_bytes:
+                    measures['figure_bytes'] = shown_bytes
+                _record(recorder, func, start, peak, measures, error)
+
+    wrapper.__wrapped_by_instrumentation__ = True
+    return wrapper
+
+
+def enable(modules=DEFAULT_MODULES, run_id=None, trace_memory=True):
+    """
+    Start recording calls to the public functions of modules, returns the Recorder.
+
+    Parameters:
+    - modules (list): module names or modules, default db_support, plot_support and cus_support.
+      Only the functions defined in the module are wrapped, not the ones it imports.
+    - run_id (str): tag of the run in the log.
+    - trace_memory (bool): see Recorder.
+
+    Code that imported a function directly (from src.db_support import execute_sql_file) before
+    enable() keeps the original; calls through the module (dbs.execute_sql_file) are recorded.
+    """
+    global _recorder
+    _recorder = Recorder(run_id, trace_memory)
+    for module in modules:
+        module = importlib.import_module(module) if isinstance(module, str) else module
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if name.startswith('_') or func.__module__ != module.__name__:
+                continue
+            if getattr(func, '__wrapped_by_instrumentation__', False):
+                continue
+            _originals[(module, name)] = func
+            setattr(module, name, _wrap(func))
+    figure_class = _figure_class()
+    if (figure_class, 'show') not in _originals:
+        _originals[(figure_class, 'show')] = figure_class.show
+        figure_class.show = _show
+    return _recorder
+
+
+def disable():
+    """
+    Put the original functions (and BaseFigure.show) back and stop recording, returns the
+    Recorder of the run.
+    """
+    global _recorder
+    for (module, name), func in _originals.items():
+        setattr(module, name, func)
+    _originals.clear()
+    recorder, _recorder = _recorder, None
+    if recorder is not None and recorder.trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return recorder
+
+
+@contextmanager
+def instrument(log_dir=DEFAULT_LOG_DIR, modules=DEFAULT_MODULES, run_id=None, trace_memory=True):
+    """
+    Record the calls made inside a with block and write them when it exits:
+    <log_dir>/runs.jsonl (appended, one line per call) and <log_dir>/trace-<run_id>.json.
+
+        with instrument() as recorder:
+            df = dbs.execute_sql_file(sql_file_path)
+            plt.plot_cluster_pie_chart(df)
+        recorder.summary()
+    """
+    recorder = enable(modules, run_id, trace_memory)
+    try:
+        yield recorder
+    finally:
+        disable()
+        recorder.write_log(os.path.join(log_dir, 'runs.jsonl'))
+        recorder.write_chrome_trace(os.path.join(log_dir, f'trace-{recorder.run_id}.json'))
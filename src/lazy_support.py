@@ -0,0 +1,151 @@
+# Import the needed libraries
+
+import argparse
+import importlib
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+import threading
+import types
+
+# Heavy optional dependencies (plotly, ipywidgets, SQLAlchemy, dotenv, scikit-learn, scipy,
+# joblib) are imported on first use instead of when a src module is imported, so a script or
+# worker that needs one helper does not pay for all of them. check_import_times measures the cold
+# import of every src module in a fresh interpreter and reports the ones over budget, run it
+# with `python -m src.lazy_support` (exit code 1 on a regression).
+
+# Seconds allowed for a cold `import src.<module>`; pandas alone takes about half a second.
+# Every module under src/ is checked with the default budget unless it has its own here.
+DEFAULT_IMPORT_BUDGET = 1.0
+IMPORT_BUDGETS = {}
+# Modules that must not be loaded by importing the src modules (pyarrow is not in the list,
+# recent pandas versions import it themselves)
+HEAVY_MODULES = ['plotly.express', 'plotly.graph_objects', 'ipywidgets', 'sqlalchemy', 'dotenv', 'sklearn',
+                 'scipy', 'joblib']
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that imports it on the first attribute access.
+    """
+
+    def __init__(self, name, on_load=None):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_on_load'] = on_load
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with self.__dict__['_lazy_lock']:
+                module = self.__dict__['_lazy_module']
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    if self.__dict__['_lazy_on_load']:
+                        self.__dict__['_lazy_on_load'](module)
+                    self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name, on_load=None):
+    """
+    Module that is imported when one of its attributes is first used, e.g.
+    `px = lazy_import('plotly.express')` instead of `import plotly.express as px`.
+    A module that is already imported is returned as is.
+
+    Parameters:
+    - name (str): full module name.
+    - on_load: function called with the module right after the real import (e.g. to
+      configure it).
+    """
+    if name in sys.modules:
+        module = sys.modules[name]
+        if on_load:
+            on_load(module)
+        return module
+    return LazyModule(name, on_load)
+
+
+def src_modules():
+    """
+    Names of every module of the src package, e.g. ['src.bench_support', ...].
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    return sorted(f'src.{info.name}' for info in pkgutil.iter_modules([package_dir]))
+
+
+def import_budgets(default=DEFAULT_IMPORT_BUDGET):
+    """
+    Budget of every src module: its IMPORT_BUDGETS entry, or default.
+    """
+    return {module: IMPORT_BUDGETS.get(module, default) for module in src_modules()}
+
+
+def _cold_import(module):
+    # Import module in a fresh interpreter, returns (seconds, heavy modules it loaded)
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]\n"
+        "print(json.dumps({'seconds': seconds, 'heavy': heavy}))\n"
+    )
+    # Run from the folder holding the src package, so it imports from any working directory
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=root).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['heavy']
+
+
+def check_import_times(budgets=None, repeat=3):
+    """
+    Measure the cold import time of src modules against their budgets.
+
+    Parameters:
+    - budgets (dict): module name -> seconds allowed, every src module by default (see
+      import_budgets).
+    - repeat (int): fresh interpreters per module, the fastest run counts (the first one can
+      be slowed down by a cold disk cache).
+
+    Returns:
+    - list of dicts with module, seconds, budget, heavy_modules (loaded eagerly, should be
+      empty) and ok.
+    """
+    budgets = import_budgets() if budgets is None else budgets
+    report = []
+    for module, budget in budgets.items():
+        runs = [_cold_import(module) for _ in range(repeat)]
+        seconds = min(run[0] for run in runs)
+        heavy = runs[0][1]
+        report.append({'module': module, 'seconds': round(seconds, 3), 'budget': budget, 'heavy_modules': heavy,
+                       'ok': seconds <= budget and not heavy})
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the cold import time of the src modules.')
+    parser.add_argument('--budget', type=float, default=None, help='seconds allowed for every module')
+    parser.add_argument('--repeat', type=int, default=3)
+    arguments = parser.parse_args()
+
+    budgets = import_budgets() if arguments.budget is None else {module: arguments.budget for module in src_modules()}
+    report = check_import_times(budgets, arguments.repeat)
+    for row in report:
+        status = 'ok' if row['ok'] else 'OVER BUDGET'
+        heavy = f" (loads {', '.join(row['heavy_modules'])})" if row['heavy_modules'] else ''
+        print(f"{row['module']}: {row['seconds']:.3f}s / {row['budget']:.3f}s {status}{heavy}")
+    sys.exit(0 if all(row['ok'] for row in report) else 1)
@@ -0,0 +1,391 @@
+# Import the needed libraries
+
+import os
+import re
+from datetime import datetime
+import pandas as pd
+from src import db_support as dbs
+from src import profile_support as prof
+from src.lazy_support import lazy_import
+
+sa = lazy_import('sqlalchemy')
+
+# Per user summary tables for the heavy CTEs of All_info_combined.sql, so the combined query
+# reads them instead of re-aggregating sessions, flights and hotels on every run: combined_query
+# only joins the summaries with users and redoes the cheap per user formulas and scalings.
+#
+# The summaries are plain tables rather than PostgreSQL materialized views because REFRESH
+# MATERIALIZED VIEW always recomputes everything. Every summary is per user, so an incremental
+# refresh only recomputes the users with sessions that ended after the last refresh: their rows
+# are deleted and re-inserted from the same CTE text restricted to those users, in one
+# transaction. The watermark of every table is kept in mv_refresh_state.
+
+COMBINED_SQL = os.path.join('SQL', 'All_info_combined.sql')
+SQL_FILES = [os.path.join('SQL', 'All_info_combined.sql'), os.path.join('SQL', 'All_Data.sql')]
+SOURCE_TABLES = ['users', 'sessions', 'flights', 'hotels']
+
+# CTE name -> summary table name
+SUMMARY_TABLES = {
+    'UserNightsSummary': 'mv_user_nights_summary',
+    'UserTravelSpendSummary': 'mv_user_travel_spend_summary',
+    'UserDiscountMetrics': 'mv_user_discount_metrics',
+    'distance_metrics': 'mv_user_distance_metrics',
+    'UserLatestSession': 'mv_user_latest_session',
+}
+# Summaries that are not CTEs of the SQL file: the one session aggregate of FinalQuery
+EXTRA_CTES = {
+    'UserLatestSession': "SELECT fs.user_id, MAX(DATE(fs.session_end)) AS latest_session\n"
+                         "  FROM FilteredSessions fs\n"
+                         "  GROUP BY fs.user_id",
+}
+STATE_TABLE = 'mv_refresh_state'
+# CTE every summary gets its users from, restricted to the changed users on refresh
+COHORT_CTE = 'UserSessions'
+# CTE with the output rows, rewritten by combined_query to read one row per user
+FINAL_CTE = 'FinalQuery'
+SESSIONS_CTE = 'FilteredSessions'
+LATEST_SESSION_EXPRESSION = 'MAX(DATE(fs.session_end))'
+
+CHANGED_USERS_SQL = "SELECT DISTINCT user_id FROM sessions WHERE session_end > :watermark"
+
+
+def _read_ctes(sql_file_path):
+    # CTEs of the file plus EXTRA_CTES, each one placed right after the CTEs it reads from
+    with open(sql_file_path, 'r') as file:
+        ctes, final_query = prof.split_ctes(file.read())
+    for name, body in EXTRA_CTES.items():
+        reads = [position for position, (other, _) in enumerate(ctes)
+                 if re.search(rf'\b{re.escape(other)}\b', body, re.IGNORECASE)]
+        ctes.insert(max(reads) + 1 if reads else 0, (name, body))
+    return ctes, final_query
+
+
+def _needed_ctes(ctes, name):
+    # The CTE and everything it reads from, in definition order
+    dependencies = prof.cte_dependencies(ctes)
+    needed = {name}
+    stack = [name]
+    while stack:
+        for dependency in dependencies[stack.pop()]:
+            if dependency not in needed:
+                needed.add(dependency)
+                stack.append(dependency)
+    return [(cte, body) for cte, body in ctes if cte in needed]
+
+
+def summary_query(cte_name, sql_file_path=COMBINED_SQL, changed_users_only=False):
+    """
+    SELECT of one summary CTE with the CTEs it depends on.
+
+    Parameters:
+    - cte_name (str): one of SUMMARY_TABLES.
+    - sql_file_path (str): SQL file defining the CTE.
+    - changed_users_only (bool): restrict the cohort to the users with sessions ending after
+      :watermark. Every summary is grouped by user, so the rows of these users come out exactly
+      as in a full run.
+    """
+    ctes, _ = _read_ctes(sql_file_path)
+    needed = _needed_ctes(ctes, cte_name)
+    if changed_users_only:
+        needed = [
+            (name, f"SELECT * FROM (\n{body}\n) cohort WHERE cohort.user_id IN ({CHANGED_USERS_SQL})"
+             if name == COHORT_CTE else body)
+            for name, body in needed
+        ]
+    return prof.build_query(needed, f'SELECT * FROM {cte_name}')
+
+
+def _max_session_end(connection):
+    return connection.execute(sa.text("SELECT MAX(session_end) FROM sessions")).scalar()
+
+
+def _save_watermark(connection, table, watermark):
+    connection.execute(sa.text(f"DELETE FROM {STATE_TABLE} WHERE table_name = :table"), {'table': table})
+    connection.execute(
+        sa.text(f"INSERT INTO {STATE_TABLE} (table_name, watermark, refreshed_at) VALUES (:table, :watermark, :now)"),
+        {'table': table, 'watermark': watermark, 'now': datetime.now()},
+    )
+
+
+def create_summaries(sql_file_path=COMBINED_SQL, summaries=SUMMARY_TABLES):
+    """
+    Build (or rebuild) the summary tables from scratch, with an index on user_id.
+
+    Parameters:
+    - sql_file_path (str): SQL file defining the summary CTEs.
+    - summaries (dict): CTE name -> table name.
+
+    Returns:
+    - dict table name -> rows.
+    """
+    rows = {}
+    with dbs.get_engine().begin() as connection:
+        connection.execute(sa.text(
+            f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} "
+            "(table_name VARCHAR(128) PRIMARY KEY, watermark TIMESTAMP, refreshed_at TIMESTAMP)"
+        ))
+        # Read the watermark first: sessions that land while the tables are built are picked
+        # up by the next refresh (at worst recomputed twice, never missed)
+        watermark = _max_session_end(connection)
+        for cte_name, table in summaries.items():
+            connection.execute(sa.text(f"DROP TABLE IF EXISTS {table}"))
+            connection.execute(sa.text(f"CREATE TABLE {table} AS {summary_query(cte_name, sql_file_path)}"))
+            connection.execute(sa.text(f"CREATE INDEX ix_{table}_user_id ON {table} (user_id)"))
+            _save_watermark(connection, table, watermark)
+            rows[table] = connection.execute(sa.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+    return rows
+
+
+def refresh_summaries(sql_file_path=COMBINED_SQL, summaries=SUMMARY_TABLES, full=False):
+    """
+    Bring the summary tables up to date with the sessions table.
+
+    Only the users with sessions that ended after the table's watermark are recomputed; a
+    table that was never built is built in full. Every table is refreshed in one transaction,
+    so readers never see a half refreshed summary.
+
+    Returns:
+    - dict table name -> number of users with new sessions that were recomputed (None for a
+      full build).
+    """
+    if full:
+        create_summaries(sql_file_path, summaries)
+        return {table: None for table in summaries.values()}
+
+    watermarks = summary_state()
+    missing = {cte: table for cte, table in summaries.items() if table not in watermarks.index}
+    result = {}
+    if missing:
+        create_summaries(sql_file_path, missing)
+        result.update({table: None for table in missing.values()})
+
+    with dbs.get_engine().begin() as connection:
+        new_watermark = _max_session_end(connection)
+        for cte_name, table in summaries.items():
+            if cte_name in missing:
+                continue
+            watermark = watermarks.at[table, 'watermark']
+            watermark = None if pd.isna(watermark) else pd.Timestamp(watermark).to_pydatetime()
+            if watermark is not None and new_watermark is not None and pd.Timestamp(new_watermark) <= pd.Timestamp(watermark):
+                result[table] = 0
+                continue
+            params = {'watermark': watermark or datetime.min}
+            changed = connection.execute(sa.text(f"SELECT COUNT(*) FROM ({CHANGED_USERS_SQL}) changed"), params).scalar()
+            connection.execute(sa.text(f"DELETE FROM {table} WHERE user_id IN ({CHANGED_USERS_SQL})"), params)
+            connection.execute(
+                sa.text(f"INSERT INTO {table} SELECT * FROM (\n"
+                        f"{summary_query(cte_name, sql_file_path, changed_users_only=True)}\n) refreshed"),
+                params,
+            )
+            _save_watermark(connection, table, new_watermark)
+            result[table] = changed
+    return result
+
+
+def summary_state():
+    """
+    Watermark and last refresh time of every summary table, indexed by table_name.
+    """
+    with dbs.connect() as connection:
+        if STATE_TABLE not in sa.inspect(connection).get_table_names():
+            return pd.DataFrame(columns=['watermark', 'refreshed_at'], index=pd.Index([], name='table_name'))
+        return pd.read_sql_query(f"SELECT * FROM {STATE_TABLE}", connection).set_index('table_name')
+
+
+def _top_level(sql, pattern):
+    # Position of the first match of pattern outside parentheses, None when there is none
+    for match in re.finditer(pattern, sql, re.IGNORECASE):
+        before = sql[:match.start()]
+        if before.count('(') == before.count(')'):
+            return match.start()
+    return None
+
+
+def _per_user_final(body):
+    # FinalQuery driven by UserLatestSession (one row per cohort user, under the FilteredSessions
+    # alias) instead of one row per session, so the GROUP BY over every column goes away
+    group_by = _top_level(body, r'\bgroup\s+by\b')
+    body = body[:group_by].rstrip() if group_by is not None else body
+    body = body.replace(LATEST_SESSION_EXPRESSION, 'fs.latest_session')
+    body = re.sub(rf'\b{SESSIONS_CTE}\s+fs\b', 'UserLatestSession fs', body)
+    other = re.search(r'\bfs\.(?!user_id\b|latest_session\b)\w+', body)
+    if other or 'UserLatestSession fs' not in body:
+        raise ValueError(f"{FINAL_CTE} reads {other.group(0) if other else SESSIONS_CTE} per session, "
+                         "add a summary for it to EXTRA_CTES")
+    return body
+
+
+def combined_query(sql_file_path=COMBINED_SQL, summaries=SUMMARY_TABLES):
+    """
+    The combined query read from the summary tables, e.g. pd.read_sql_query(combined_query(),
+    connection). FinalQuery is rewritten to one row per user of the summaries joined with users,
+    so sessions, flights and hotels are not read at all; only the per user formulas and the
+    cohort wide scalings (UserBehaviorIndices, ScaledTravelMetrics, scaled_metrics) run. Gives
+    the same result as the SQL file as long as the summaries are refreshed.
+    """
+    ctes, final_query = _read_ctes(sql_file_path)
+    ctes = [(name, f'SELECT * FROM {summaries[name]}' if name in summaries
+             else _per_user_final(body) if name == FINAL_CTE else body) for name, body in ctes]
+    # Drop the CTEs only the summaries needed
+    used = _needed_ctes(ctes + [('__final__', final_query)], '__final__')
+    return prof.build_query([cte for cte in used if cte[0] != '__final__'], final_query)
+
+
+def execute_combined(sql_file_path=COMBINED_SQL, summaries=SUMMARY_TABLES, refresh=True):
+    """
+    Run the combined query on the summary tables, refreshing them first (incrementally).
+    """
+    if refresh:
+        refresh_summaries(sql_file_path, summaries)
+    with dbs.connect() as connection:
+        return pd.read_sql_query(sa.text(combined_query(sql_file_path, summaries)), connection)
+
+
+# Index advisor
+
+ALIAS_PATTERN = re.compile(r'\b(from|join)\s+(\w+)(?:\s+(?:as\s+)?(?!on\b|where\b|join\b|left\b|inner\b|group\b|order\b|cross\b)(\w+))?',
+                           re.IGNORECASE)
+JOIN_PATTERN = re.compile(r'\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)')
+FILTER_PATTERN = re.compile(r"(?:\b(\w+)\.)?\b(\w+)\s*(>=|<=|<>|!=|>|<|=|\bbetween\b|\bin\b)\s*(?=['\d:(])",
+                            re.IGNORECASE)
+GROUP_PATTERN = re.compile(r'\bgroup\s+by\s+(.+?)(?:\bhaving\b|\border\b|$)', re.IGNORECASE | re.DOTALL)
+
+
+def _access_patterns(sql_query, tables):
+    # (table, column, kind) for the join, filter and group by columns of base tables. A join
+    # column only counts for the table its JOIN clause brings in, the one looked up by it: in
+    # `FROM sessions s ... JOIN flights f ON f.trip_id = s.trip_id` an index on flights.trip_id
+    # is used, one on sessions.trip_id never is
+    found = []
+    ctes, final_query = prof.split_ctes(sql_query)
+    for body in [body for _, body in ctes] + [final_query]:
+        aliases = {}
+        join_clauses = []
+        for match in ALIAS_PATTERN.finditer(body):
+            keyword, table, alias = match.groups()
+            if keyword.lower() == 'join':
+                join_clauses.append((match.start(), (alias or table).lower()))
+            if table.lower() in tables:
+                aliases[(alias or table).lower()] = table.lower()
+                aliases[table.lower()] = table.lower()
+        if not aliases:
+            continue
+        single_table = next(iter(set(aliases.values()))) if len(set(aliases.values())) == 1 else None
+
+        def resolve(alias, column):
+            table = aliases.get(alias.lower()) if alias else single_table
+            return (table, column.lower()) if table else None
+
+        for match in JOIN_PATTERN.finditer(body):
+            left_alias, left_column, right_alias, right_column = match.groups()
+            looked_up = [alias for start, alias in join_clauses if start < match.start()][-1:]
+            for alias, column in ((left_alias, left_column), (right_alias, right_column)):
+                resolved = resolve(alias, column) if [alias.lower()] == looked_up else None
+                if resolved:
+                    found.append((*resolved, 'join'))
+        where = re.split(r'\bwhere\b', body, maxsplit=1, flags=re.IGNORECASE)
+        if len(where) == 2:
+            for alias, column, _ in FILTER_PATTERN.findall(where[1]):
+                resolved = resolve(alias, column)
+                if resolved:
+                    found.append((*resolved, 'filter'))
+        for group_by in GROUP_PATTERN.findall(body):
+            for expression in group_by.split(','):
+                match = re.fullmatch(r'\s*(?:(\w+)\.)?(\w+)\s*', expression)
+                resolved = resolve(*match.groups()) if match else None
+                if resolved:
+                    found.append((*resolved, 'group'))
+    return found
+
+
+def _existing_indexes(tables):
+    # Leading columns of the indexes and primary keys of every table
+    inspector = sa.inspect(dbs.get_engine())
+    existing = {}
+    for table in tables:
+        columns = []
+        try:
+            primary_key = inspector.get_pk_constraint(table).get('constrained_columns') or []
+            columns.append([column.lower() for column in primary_key])
+            columns.extend([column.lower() for column in index['column_names'] if column]
+                           for index in inspector.get_indexes(table))
+        except (NotImplementedError, sa.exc.SQLAlchemyError):
+            pass
+        existing[table] = [index for index in columns if index]
+    return existing
+
+
+def recommend_indexes(sql_files=SQL_FILES, tables=SOURCE_TABLES, check_database=True):
+    """
+    Suggest indexes for the join, filter and group by columns the SQL files use on the source tables.
+
+    A filter column gets a composite index with the table's most used join or group by column
+    (e.g. sessions (session_start, user_id) for the cohort CTE, which can then be answered from
+    the index alone); the columns a joined table is looked up by get a single column index
+    (e.g. flights (trip_id)). The other side of a join condition is not indexed, the plan drives
+    the join from it. Columns already leading an existing index or the primary key are skipped.
+
+    Parameters:
+    - sql_files (list): SQL files to analyse.
+    - tables (list): base tables to index.
+    - check_database (bool): look up the existing indexes (needs a connection).
+
+    Returns:
+    - pd.DataFrame with table, columns, uses (how often the access pattern appears), reason and
+      the CREATE INDEX statement.
+    """
+    tables = [table.lower() for table in tables]
+    patterns = []
+    for sql_file_path in sql_files:
+        with open(sql_file_path, 'r') as file:
+            patterns.extend(_access_patterns(file.read(), tables))
+    usage = pd.DataFrame(patterns, columns=['table', 'column', 'kind'])
+    existing = _existing_indexes(tables) if check_database else {}
+
+    recommendations = []
+    counts = usage.groupby(['table', 'column', 'kind']).size()
+    for table in tables:
+        if table not in counts.index.get_level_values('table'):
+            continue
+        table_counts = counts.loc[table]
+        join_columns = (table_counts.xs('join', level='kind') if 'join' in table_counts.index.get_level_values('kind')
+                        else pd.Series(dtype=int))
+        key_columns = pd.concat([join_columns, table_counts.xs('group', level='kind')
+                                 if 'group' in table_counts.index.get_level_values('kind') else pd.Series(dtype=int)])
+        key_columns = key_columns.groupby(level=0).sum().sort_values(ascending=False)
+
+        candidates = []
+        if 'filter' in table_counts.index.get_level_values('kind'):
+            for column, uses in table_counts.xs('filter', level='kind').items():
+                covering = [key for key in key_columns.index if key != column][:1]
+                candidates.append(([column] + covering, uses, 'filter' + (f' then {covering[0]}' if covering else '')))
+        for column, uses in join_columns.items():
+            candidates.append(([column], uses, 'join'))
+
+        seen = set()
+        for columns, uses, reason in candidates:
+            leading = [index[:len(columns)] for index in existing.get(table, [])]
+            if tuple(columns) in seen or columns in leading:
+                continue
+            seen.add(tuple(columns))
+            name = f"ix_{table}_{'_'.join(columns)}"
+            recommendations.append({
+                'table': table,
+                'columns': columns,
+                'uses': int(uses),
+                'reason': reason,
+                'statement': f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})",
+            })
+
+    return pd.DataFrame(recommendations, columns=['table', 'columns', 'uses', 'reason', 'statement'])
+
+
+def create_indexes(recommendations):
+    """
+    Run the CREATE INDEX statements of recommend_indexes, returns them.
+    """
+    statements = list(recommendations['statement'])
+    with dbs.get_engine().begin() as connection:
+        for statement in statements:
+            connection.execute(sa.text(statement))
+    return statements
@@ -0,0 +1,325 @@
+# Import the needed libraries
+
+import inspect
+import json
+import os
+import time
+import types
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from src import cache_support
+from src import cluster_support as cls
+from src import db_support as dbs
+from src import plot_support as plt
+from src import summary_support
+from src.cluster_support import joblib, sk_cluster, sk_preprocessing
+
+# The notebook flow (SQL fetch, flight_hunter_index, fillna, scaling, KMeans, labels, plots,
+# CSV export) as named stages. Every stage output is saved on disk under a key built from the
+# stage's code (its source, the src functions and constants it reads and the code it declares),
+# its parameters and the hashes of its inputs' outputs; a run only executes
+# the stages whose key changed, and a re-run stage that gives the same output as before does not
+# invalidate the stages after it. Stages whose inputs are ready run in parallel threads.
+
+DEFAULT_PIPELINE_DIR = os.path.join(cache_support.DEFAULT_CACHE_DIR, 'pipeline')
+# Module attributes a stage reads are followed into the modules of this package only
+PACKAGE = __name__.split('.')[0]
+
+
+def _file_text(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+
+def _source(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        # Functions defined in a console have no source file, fall back to the bytecode
+        code = getattr(obj, '__code__', None)
+        return code.co_code.hex() if code is not None else type(obj).__name__
+
+
+def _value_fingerprint(value):
+    if isinstance(value, types.ModuleType) or inspect.isroutine(value) or inspect.isclass(value):
+        return _source(value)
+    try:
+        return joblib.hash(value)
+    except Exception:
+        return type(value).__name__
+
+
+def _code_names(code):
+    # Global and attribute names read by a code object and the lambdas / comprehensions in it
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def _referenced_globals(func):
+    # (name, value) of the globals the function reads, and of the attributes it reads on modules
+    # of this package, e.g. plt.plot_cluster_heatmap and cls.CLUSTER_LABELS for cluster_heatmap
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return []
+    def own(value):
+        # Modules of other packages (numpy, sklearn, ...) are not followed
+        return not isinstance(value, types.ModuleType) or value.__name__.split('.')[0] == PACKAGE
+
+    names = sorted(_code_names(code))
+    referenced = []
+    for name in names:
+        value = func.__globals__.get(name)
+        if name not in func.__globals__ or not own(value):
+            continue
+        if isinstance(value, types.ModuleType):
+            referenced += [(f'{name}.{attribute}', vars(value)[attribute])
+                           for attribute in names if attribute in vars(value) and own(vars(value)[attribute])]
+        else:
+            referenced.append((name, value))
+    return referenced
+
+
+def _code_fingerprint(func, code=()):
+    """
+    Fingerprint of everything a stage runs besides its inputs and params: its source and default
+    arguments, the functions and constants it reads (one level deep, e.g. a plot_support function
+    or cls.CLUSTER_LABELS) and the declared code (modules, functions or values).
+    """
+    defaults = (getattr(func, '__defaults__', None), getattr(func, '__kwdefaults__', None))
+    return {
+        'source': _source(func),
+        'defaults': _value_fingerprint(defaults),
+        'globals': {name: _value_fingerprint(value) for name, value in _referenced_globals(func)},
+        'code': [_value_fingerprint(item) for item in code],
+    }
+
+
+class Pipeline:
+    """
+    Stages with declared inputs and disk memoization.
+
+    Parameters:
+    - cache_dir (str): folder of the memoized outputs, one joblib file per stage and key.
+    - max_workers (int): stages run at the same time.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_PIPELINE_DIR, max_workers=4):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.stages = {}
+        self.last_run = {}
+
+    def add(self, name, func, inputs=(), params=None, depends_on=None, files=(), code=()):
+        """
+        Add a stage, called as func(*input outputs, **params).
+
+        Parameters:
+        - name (str): stage name, used as the input name by later stages.
+        - func: function computing the output.
+        - inputs (list): names of the stages whose outputs are passed, in order.
+        - params (dict): keyword arguments, part of the fingerprint (JSON serialisable).
+        - depends_on: function returning a JSON serialisable value mixed into the fingerprint
+          for state outside the pipeline, e.g. dbs.table_fingerprint for a SQL fetch.
+        - files (list): files the stage writes, the stage re-runs when one of them is missing.
+        - code (list): modules or functions the stage depends on besides the ones it reads
+          directly, their source is part of the fingerprint (e.g. [summary_support] for a stage
+          whose plot function builds a ClusterSummary).
+        """
+        missing = [stage for stage in inputs if stage not in self.stages]
+        if missing:
+            raise ValueError(f"stage {name!r} reads unknown stages {missing}, add them first")
+        self.stages[name] = {'func': func, 'inputs': list(inputs), 'params': dict(params or {}),
+                             'depends_on': depends_on, 'files': list(files), 'code': list(code)}
+        return self
+
+    def stage(self, name=None, inputs=(), params=None, depends_on=None, files=(), code=()):
+        """
+        Decorator version of add, the stage name defaults to the function name.
+        """
+        def register(func):
+            self.add(name or func.__name__, func, inputs, params, depends_on, files, code)
+            return func
+        return register
+
+    def _upstream(self, targets):
+        needed = []
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.stages:
+                raise ValueError(f"unknown stage {name!r}")
+            if name not in needed:
+                needed.append(name)
+                stack.extend(self.stages[name]['inputs'])
+        # Keep the definition order, which is a valid execution order
+        return [name for name in self.stages if name in needed]
+
+    def _key(self, name, input_hashes):
+        stage = self.stages[name]
+        external = stage['depends_on']() if stage['depends_on'] else None
+        return cache_support.cache_key(name, _code_fingerprint(stage['func'], stage['code']), stage['params'],
+                                       input_hashes, external)
+
+    def _paths(self, name, key):
+        base = os.path.join(self.cache_dir, f'{name}-{key}')
+        return base + '.joblib', base + '.json'
+
+    def _load(self, name, key):
+        output_path, meta_path = self._paths(name, key)
+        if not (os.path.exists(output_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        return joblib.load(output_path), meta['output_hash']
+
+    def _store(self, name, key, output):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        output_path, meta_path = self._paths(name, key)
+        output_hash = joblib.hash(output)
+        joblib.dump(output, output_path + '.tmp')
+        os.replace(output_path + '.tmp', output_path)
+        with open(meta_path + '.tmp', 'w') as file:
+            json.dump({'stage': name, 'key': key, 'output_hash': output_hash}, file)
+        os.replace(meta_path + '.tmp', meta_path)
+        return output_hash
+
+    def _execute(self, name, inputs, input_hashes, force):
+        start = time.perf_counter()
+        key = self._key(name, input_hashes)
+        stage = self.stages[name]
+        files_exist = all(os.path.exists(path) for path in stage['files'])
+        cached = None if force or not files_exist else self._load(name, key)
+        if cached is not None:
+            output, output_hash = cached
+            status = 'cached'
+        else:
+            output = stage['func'](*inputs, **stage['params'])
+            output_hash = self._store(name, key, output)
+            status = 'ran'
+        return output, output_hash, {'status': status, 'seconds': time.perf_counter() - start, 'key': key}
+
+    def run(self, targets=None, force=()):
+        """
+        Run the stages needed for targets, skipping the ones with an up to date output on disk.
+
+        Parameters:
+        - targets (list): stage names to produce, None for every stage.
+        - force (list): stages to run even when their output is memoized (their dependents
+          only re-run when the output changes).
+
+        Returns:
+        - dict of stage name to output for every stage that was needed. The status ('cached'
+          or 'ran') and time of each stage are in last_run.
+        """
+        names = self._upstream(targets or list(self.stages))
+        outputs, hashes = {}, {}
+        self.last_run = {}
+        remaining = list(names)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while remaining or running:
+                for name in list(remaining):
+                    stage_inputs = self.stages[name]['inputs']
+                    if all(stage in outputs for stage in stage_inputs):
+                        remaining.remove(name)
+                        future = executor.submit(self._execute, name, [outputs[stage] for stage in stage_inputs],
+                                                 [hashes[stage] for stage in stage_inputs], name in force)
+                        running[future] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    outputs[name], hashes[name], self.last_run[name] = future.result()
+
+        return {name: outputs[name] for name in names}
+
+    def clear(self):
+        """
+        Delete every memoized output, returns the removed paths.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        removed = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(('.joblib', '.json')):
+                os.remove(os.path.join(self.cache_dir, file_name))
+                removed.append(os.path.join(self.cache_dir, file_name))
+        return removed
+
+
+# Stages of the notebook flow
+
+def fetch_combined(sql_file_path=cls.COMBINED_SQL):
+    return dbs.execute_sql_file(sql_file_path)
+
+
+def derive_features(combined):
+    df = combined.copy()
+    df['flight_hunter_index'] = df['scaled_ads_per_km'] * df['flight_discount_proportion'] * df['average_flight_discount']
+    df['total_nights'] = df['total_nights'].fillna(0)
+    return df
+
+
+def scale_features(df, features=cls.FEATURES):
+    df = df.copy()
+    df[[feature + '_scaled' for feature in features]] = sk_preprocessing.StandardScaler().fit_transform(df[features])
+    return df
+
+
+def cluster_users(df, features=cls.FEATURES, n_clusters=5, n_init=10, random_state=42, labels=None):
+    df = df.copy()
+    model = sk_cluster.KMeans(n_clusters=n_clusters, n_init=n_init, random_state=random_state)
+    df['cluster'] = model.fit_predict(df[[feature + '_scaled' for feature in features]])
+    labels = cls.CLUSTER_LABELS if labels is None else {int(cluster): label for cluster, label in labels.items()}
+    df['cluster_label'] = df['cluster'].map(labels)
+    return df
+
+
+def cluster_heatmap(df, features=cls.FEATURES):
+    return plt.plot_cluster_heatmap(df, 'cluster', [feature + '_scaled' for feature in features], 'cluster_label',
+                                    show=False)
+
+
+def cluster_pie(df):
+    return plt.plot_cluster_pie_chart(df, show=False)
+
+
+def city_sunburst(df, top_n=5):
+    return plt.plot_sunburst_chart(df, category_column='home_city', top_n=top_n,
+                                   chart_title='Top City Preferences by Perk', show=False)
+
+
+def age_sunburst(df):
+    return plt.plot_sunburst_chart(df, category_column='age_group', chart_title='Age Group by Perk', show=False)
+
+
+def export_csv(df, csv_path=os.path.join('csv', 'Final_output.csv')):
+    df.to_csv(csv_path, index=False)
+    return csv_path
+
+
+def build_segmentation_pipeline(sql_file_path=cls.COMBINED_SQL, n_clusters=5, csv_path=os.path.join('csv', 'Final_output.csv'),
+                                cache_dir=DEFAULT_PIPELINE_DIR, max_workers=4):
+    """
+    The notebook's segmentation flow as a Pipeline: fetch -> features -> scaled -> clusters,
+    then the plots (figures, e.g. for export_support.export_figures) and the CSV export, which
+    only depend on clusters and run in parallel.
+
+    The fetch stage is keyed by dbs.table_fingerprint(), so new rows in the source tables
+    re-run it; the later stages only re-run when its result actually changed.
+    """
+    pipeline = Pipeline(cache_dir, max_workers)
+    pipeline.add('combined', fetch_combined, params={'sql_file_path': sql_file_path},
+                 depends_on=lambda: [_file_text(sql_file_path), dbs.table_fingerprint()])
+    pipeline.add('features', derive_features, ['combined'])
+    pipeline.add('scaled', scale_features, ['features'])
+    pipeline.add('clusters', cluster_users, ['scaled'], params={'n_clusters': n_clusters})
+    # The heatmap and sunburst functions aggregate with summary_support
+    pipeline.add('cluster_heatmap', cluster_heatmap, ['clusters'], code=[summary_support])
+    pipeline.add('cluster_pie', cluster_pie, ['clusters'])
+    pipeline.add('city_sunburst', city_sunburst, ['clusters'], code=[summary_support])
+    pipeline.add('age_sunburst', age_sunburst, ['clusters'], code=[summary_support])
+    pipeline.add('export_csv', export_csv, ['clusters'], params={'csv_path': csv_path}, files=[csv_path])
+    return pipeline
@@ -1,57 +1,111 @@
-import plotly.graph_objects as go
-import plotly.express as px
-import plotly.io as pio
-from plotly.subplots import make_subplots
 import os
 import pandas as pd
 import numpy as np
-# To resolve the git dynamic image rendring issue, for ploty chart, i enable it as a static image. you can disable to create Dynamic charts in your notbook
-pio.renderers.default = "png"
+from src import cluster_support as cls
+from src import stats_support as sts
+from src.summary_support import ClusterSummary, top_n_per_group
+from src.lazy_support import lazy_import
+
+
+def _use_static_renderer(module):
+    # To resolve the git dynamic image rendring issue, for ploty chart, i enable it as a static image. you can disable to create Dynamic charts in your notbook
+    pio.renderers.default = "png"
+
+
+# Plotly is imported when the first chart is built, not when this module is imported
+pio = lazy_import('plotly.io')
+go = lazy_import('plotly.graph_objects', on_load=_use_static_renderer)
+px = lazy_import('plotly.express', on_load=_use_static_renderer)
+subplots = lazy_import('plotly.subplots', on_load=_use_static_renderer)
 
 
 # Plot enblow curve
-def plot_elbow_curve(model, data, cluster_ranges):
-    inertia_values = []
-    
-    for i in cluster_ranges:
-        model.set_params(n_clusters=i)
-        model.fit(data)
-        inertia_values.append(model.inertia_)
+def plot_elbow_curve(model, data, cluster_ranges, n_jobs=None, warm_start=False, silhouette_sample=10000, show=True):
+    """
+    Fit k-means for every number of clusters and plot the inertia and silhouette score.
+
+    Parameters:
+    - model: KMeans model, only its n_init and random_state are used (it is not refitted).
+    - data: scaled feature data.
+    - cluster_ranges: numbers of clusters to try.
+    - n_jobs: worker processes to fit the k values in parallel (see cluster_support.elbow_sweep).
+    - warm_start: start every k from the previous k's centroids instead of n_init restarts.
+    - silhouette_sample: rows sampled for the silhouette score.
+    - show: display the chart (returns None), set to False to get the numbers instead (and
+      plot_elbow_results(results, show=False) for the figure).
 
+    Returns:
+    - pandas DataFrame with the numbers behind the chart when show is False.
+    """
+    params = model.get_params()
+    results = cls.elbow_sweep(data, cluster_ranges, n_init=params.get('n_init', 10), random_state=params.get('random_state'),
+                              n_jobs=n_jobs, warm_start=warm_start, silhouette_sample=silhouette_sample)
+    if not show:
+        return results
+    plot_elbow_results(results)
+
+def plot_elbow_results(results, title="Elbow Curve", show=True):
+    """
+    Plot the inertia (and silhouette score on a second axis) of an elbow sweep.
+
+    Parameters:
+    - results: pandas DataFrame from cluster_support.elbow_sweep with k, inertia and silhouette columns.
+    - title: title of the chart.
+    - show: display the figure (returns None), set to False to get it back instead (e.g. for export_support.export_figures).
+    """
     # Create the plot using Plotly
-    fig = go.Figure()
+    fig = subplots.make_subplots(specs=[[{"secondary_y": True}]])
 
     # Add a line plot for inertia values
     fig.add_trace(go.Scatter(
-        x=list(cluster_ranges), 
-        y=inertia_values, 
+        x=results['k'], 
+        y=results['inertia'], 
         mode='lines+markers', 
         marker=dict(symbol='circle', size=8),
         name='Inertia'
-    ))
+    ), secondary_y=False)
+
+    # Silhouette score, higher is better
+    if 'silhouette' in results and results['silhouette'].notna().any():
+        fig.add_trace(go.Scatter(
+            x=results['k'],
+            y=results['silhouette'],
+            mode='lines+markers',
+            marker=dict(symbol='diamond', size=8),
+            line=dict(dash='dash'),
+            name='Silhouette (sampled)'
+        ), secondary_y=True)
+        fig.update_yaxes(title_text="Silhouette score", secondary_y=True)
 
     # Add title and labels
     fig.update_layout(
-        title="Elbow Curve",
+        title=title,
         xaxis_title="Number of clusters",
-        yaxis_title="Inertia",
         template="plotly_white"
     )
+    fig.update_yaxes(title_text="Inertia", secondary_y=False)
 
     # Show the plot
+    if not show:
+        return fig
     fig.show()
 
 # Correlation heatmap between scaled values
-def plot_correlation_heatmap(correlation_matrix,  title='Correlation Matrix of Metrics'):
+def plot_correlation_heatmap(correlation_matrix,  title='Correlation Matrix of Metrics', show=True):
     """
     Generate, save, and display a Plotly heatmap for the correlation matrix.
 
     Parameters:
-    - correlation_matrix: pandas DataFrame representing the correlation matrix
+    - correlation_matrix: pandas DataFrame representing the correlation matrix, or a tidy pairs
+      table from stats_support.correlation_pairs (feature_1, feature_2, correlation)
     - img_dir_path: directory path where the heatmap image will be saved
     - file_name: name of the file to save the heatmap (default is 'CorrelationVerification.png')
     - title: title of the heatmap (default is 'Correlation Matrix of Metrics')
+    - show: display the figure (returns None), set to False to get it back instead (e.g. for export_support.export_figures)
     """
+    if {'feature_1', 'feature_2', 'correlation'}.issubset(correlation_matrix.columns):
+        correlation_matrix = sts.pairs_to_matrix(correlation_matrix)
+
     # Generate the heatmap
     fig = px.imshow(
         correlation_matrix,
@@ -70,20 +124,61 @@ def plot_correlation_heatmap(correlation_matrix,  title='Correlation Matrix of M
 
    
     # Display the heatmap
+    if not show:
+        return fig
     fig.show()
 
 
 ## scatter chart
-def plot_clusters(df, x_col, y_col, cluster_col='cluster'):
+def plot_clusters(df, x_col, y_col, cluster_col='cluster', mode='auto', max_points=20000, bins=100, random_state=42, show=True):
     """
     Plots a scatter chart for visualizing clusters using Plotly.
+
+    Large frames are reduced before plotting so the figure size and render time stay flat:
+    'sample' keeps a stratified random sample of max_points rows (every cluster keeps its share,
+    with a floor so small clusters stay visible) and 'density' bins the points into a
+    bins x bins grid per cluster and draws one marker per non-empty cell, sized by its count.
     
     Parameters:
     - df: pandas DataFrame containing the data
     - x_col: Column name to be plotted on the x-axis
     - y_col: Column name to be plotted on the y-axis
     - cluster_col: Column name that contains the cluster labels (default is 'cluster_label')
+    - mode: 'scatter' (every row), 'sample', 'density' or 'auto' (scatter up to max_points rows, sample above)
+    - max_points: point budget of the 'sample' mode
+    - bins: grid size per axis of the 'density' mode
+    - random_state: seed of the sample
+    - show: display the figure (returns None), set to False to get it back instead (e.g. for export_support.export_figures)
     """
+    labels = {x_col: x_col.replace('_', ' ').title(), y_col: y_col.replace('_', ' ').title()}
+    if mode == 'auto':
+        mode = 'scatter' if len(df) <= max_points else 'sample'
+
+    if mode == 'density':
+        points = cluster_density_grid(df, x_col, y_col, cluster_col, bins=bins)
+        fig = px.scatter(
+            points,
+            x=x_col,
+            y=y_col,
+            color=cluster_col,
+            size='count',
+            size_max=18,
+            hover_data=['count'],
+            title='Cluster Density using K-means Segmentation',
+            width=1000,
+            height=800,
+            labels=labels
+        )
+        if not show:
+            return fig
+        fig.show()
+        return
+
+    if mode == 'sample':
+        df = stratified_sample(df, cluster_col, max_points, random_state=random_state)
+    elif mode != 'scatter':
+        raise ValueError(f"mode must be 'auto', 'scatter', 'sample' or 'density', got {mode!r}")
+
     # Create the scatter plot using Plotly
     fig = px.scatter(
         df,
@@ -93,14 +188,65 @@ def plot_clusters(df, x_col, y_col, cluster_col='cluster'):
         title='Cluster Visualization using K-means Segmentation',
         width=1000,
         height=800,
-        labels={x_col: x_col.replace('_', ' ').title(), y_col: y_col.replace('_', ' ').title()}
+        labels=labels
     )
 
     # Show the plot
+    if not show:
+        return fig
     fig.show()
 
+def stratified_sample(df, cluster_col, max_points, min_per_cluster=None, random_state=42):
+    """
+    Random sample of at most max_points rows with every cluster keeping its share of the rows.
+
+    Parameters:
+    - df: pandas DataFrame containing the data
+    - cluster_col: column to stratify on
+    - max_points: total point budget
+    - min_per_cluster: rows kept from every cluster even when its share is smaller (default: 5% of the budget per cluster)
+    - random_state: seed of the sample
+    """
+    if len(df) <= max_points:
+        return df
+
+    sizes = df[cluster_col].value_counts()
+    if min_per_cluster is None:
+        min_per_cluster = max(1, max_points // (20 * len(sizes)))
+    quota = np.minimum(sizes, np.maximum(min_per_cluster, (sizes * max_points / len(df)).astype(int)))
+
+    # Shuffle once, then keep the first quota rows of every cluster
+    shuffled = df.sample(frac=1, random_state=random_state)
+    rank = shuffled.groupby(cluster_col).cumcount()
+    return shuffled[rank.to_numpy() < shuffled[cluster_col].map(quota).to_numpy()]
+
+def cluster_density_grid(df, x_col, y_col, cluster_col, bins=100):
+    """
+    2D histogram of the points per cluster on a shared grid.
+
+    Returns:
+    - pandas DataFrame with cluster_col, x_col and y_col (cell centres) and count, one row per non-empty cell
+    """
+    clusters, codes = np.unique(df[cluster_col].to_numpy(), return_inverse=True)
+    x = df[x_col].to_numpy(dtype=float)
+    y = df[y_col].to_numpy(dtype=float)
+    valid = ~(np.isnan(x) | np.isnan(y))
+
+    # One histogramdd call: x bins, y bins and one bin per cluster
+    counts, (x_edges, y_edges, _) = np.histogramdd(
+        np.column_stack([x[valid], y[valid], codes[valid]]),
+        bins=[bins, bins, np.arange(len(clusters) + 1) - 0.5],
+    )
+    x_index, y_index, cluster_index = np.nonzero(counts)
+    return pd.DataFrame({
+        cluster_col: clusters[cluster_index],
+        x_col: (x_edges[x_index] + x_edges[x_index + 1]) / 2,
+        y_col: (y_edges[y_index] + y_edges[y_index + 1]) / 2,
+        'count': counts[x_index, y_index, cluster_index].astype(int),
+    })
+
 # correlation heatmap betwen cluster and scaled columns
-def plot_cluster_heatmap(df, cluster_column, scaled_columns, label_column, title='Traveller Groups Heatmap'):
+def plot_cluster_heatmap(df, cluster_column, scaled_columns, label_column, title='Traveller Groups Heatmap', summary=None, show=True):
     """
     Create a Plotly heatmap for cluster characteristics.
 
@@ -110,22 +256,19 @@ def plot_cluster_heatmap(df, cluster_column, scaled_columns, label_column, title
     - scaled_columns: list of columns to be included in the heatmap
     - label_column: the name of the column containing custom labels for clusters
     - title: title of the heatmap
+    - summary: ClusterSummary of df, shared with the other cluster views (df is not scanned again)
+    - show: display the figure (returns None), set to False to get it back instead (e.g. for export_support.export_figures)
     """
-    # Step 1: Compute mean values for each cluster
-    cluster_summaries = {}  # Dictionary to store mean values for each cluster
-
-    for cluster in df[cluster_column].unique():  # Loop over all unique clusters
-        sub_df = df[df[cluster_column] == cluster]
-        cluster_summaries[cluster] = sub_df[scaled_columns].mean()
-
-    # Step 2: Convert the dictionary into a DataFrame for visualization
-    cluster_summary_df = pd.DataFrame.from_dict(cluster_summaries, orient='index', columns=scaled_columns)
+    # Step 1 & 2: Mean values for each cluster, computed in one grouped pass
+    if summary is None:
+        summary = ClusterSummary(df, cluster_column, label_column, columns=scaled_columns)
+    cluster_summary_df = summary.means(scaled_columns)
 
     # Step 3: Transpose the DataFrame for a better heatmap layout
     cluster_summary_transposed = cluster_summary_df.T
 
     # Step 4: Define custom x-axis labels for the clusters
-    custom_x_labels = df[label_column].unique().tolist()
+    custom_x_labels = summary.label_list()
 
     # Set the custom labels to the DataFrame
     cluster_summary_transposed.columns = custom_x_labels
@@ -157,11 +300,13 @@ def plot_cluster_heatmap(df, cluster_column, scaled_columns, label_column, title
     )
 
     # Step 7: Show the heatmap
+    if not show:
+        return fig
     fig.show()
 
 
 # Stacked bar chart with percentages
-def plot_stacked_bar_with_percentages(df, x_col, y_col, x_label='X Axis', y_label='Y Axis', title='Stacked Bar Chart'):
+def plot_stacked_bar_with_percentages(df, x_col, y_col, x_label='X Axis', y_label='Y Axis', title='Stacked Bar Chart', show=True):
     """
     Create a stacked bar chart in Plotly with percentages inside the bars, similar to the example image.
 
@@ -172,6 +317,7 @@ def plot_stacked_bar_with_percentages(df, x_col, y_col, x_label='X Axis', y_labe
     - x_label: label for the x-axis (default is 'X Axis').
     - y_label: label for the y-axis (default is 'Y Axis').
     - title: title of the stacked bar chart (default is 'Stacked Bar Chart').
+    - show: display the figure (returns None), set to False to get it back instead (e.g. for export_support.export_figures).
     """
     # Create a crosstab to summarize the data
     crosstab = pd.crosstab(df[x_col], df[y_col])
@@ -211,10 +357,12 @@ def plot_stacked_bar_with_percentages(df, x_col, y_col, x_label='X Axis', y_labe
   #  fig.update_xaxes(tickangle=45)
 
     # Show the plot
+    if not show:
+        return fig
     fig.show()
 
 # user behaviour accross difffernt Metrics
-def plot_user_behavior(df, x_column, y_columns, x_labels, y_axis_label, chart_title):
+def plot_user_behavior(df, x_column, y_columns, x_labels, y_axis_label, chart_title, summary=None, show=True):
     """
     Generic function to create a Plotly bar chart for visualizing user behavior metrics.
 
@@ -226,15 +374,16 @@ def plot_user_behavior(df, x_column, y_columns, x_labels, y_axis_label, chart_ti
     - y_axis_label (str): Label for the y-axis.
     - chart_title (str): Title of the chart.
     - file_path (str, optional): Path to save the image file. If None, the chart is not saved.
+    - summary (ClusterSummary, optional): per cluster aggregates of df grouped by x_column, shared with the other cluster views.
+    - show (bool): display the figure (returns None), set to False to get it back instead (e.g. for export_support.export_figures).
 
     Returns:
     - fig: Plotly figure object.
     """
-    # Get unique cluster IDs and initialize the lists to store metric sums
-    unique_clusters = np.sort(df[x_column].unique())
-
-    # Store sum of each metric for each cluster
-    y_sums = {col: [df[df[x_column] == cluster][col].sum() for cluster in unique_clusters] for col in y_columns}
+    # Store sum of each metric for each cluster (clusters in sorted order), in one grouped pass
+    if summary is None:
+        summary = ClusterSummary(df, x_column, label_column=None, columns=y_columns)
+    y_sums = {col: summary.sums([col])[col].tolist() for col in y_columns}
     
     # Create bar traces for each metric
     traces = []
@@ -263,10 +412,12 @@ def plot_user_behavior(df, x_column, y_columns, x_labels, y_axis_label, chart_ti
    
     # Display the chart
   
+    if not show:
+        return fig
     fig.show()
 
 # pie chart for cluster
-def plot_cluster_pie_chart(df):
+def plot_cluster_pie_chart(df, show=True):
     # Extract cluster counts from the DataFrame
     cluster_counts = df['cluster_label'].value_counts()
     
@@ -292,6 +443,8 @@ def plot_cluster_pie_chart(df):
     )
     
     # Show the chart
+    if not show:
+        return fig
     fig.show()
 
 # Sunburst chat
@@ -300,7 +453,9 @@ def plot_sunburst_chart(df,
                         category_column='home_city', 
                         value_column='count', 
                         top_n=5, 
-                        chart_title='Top Preferences by Cluster'):
+                        chart_title='Top Preferences by Cluster',
+                        show=True,
+                        top_categories=None):
     """
     Create a generic sunburst chart to visualize the top N category preferences by cluster label.
 
@@ -311,12 +466,13 @@ def plot_sunburst_chart(df,
     - value_column (str): Name of the column representing the value/count for sizing the chart segments.
     - top_n (int): Number of top categories to display per cluster.
     - chart_title (str): Title of the chart.
+    - show (bool): display the figure (returns None), set to False to get it back instead (e.g. for export_support.export_figures).
+    - top_categories (pd.DataFrame, optional): precomputed top categories, e.g. from
+      summary_support.top_n_per_group_streaming over chunks; df is not used when given.
     """
-    # Calculate the count of categories per cluster
-    category_counts = df.groupby([cluster_column, category_column]).size().reset_index(name=value_column)
-
     # Find the top N categories for each cluster
-    top_categories = category_counts.groupby(cluster_column, group_keys=False).apply(lambda x: x.nlargest(top_n, value_column)).reset_index(drop=True)
+    if top_categories is None:
+        top_categories = top_n_per_group(df, cluster_column, category_column, top_n, value_column)
 
     # Create the sunburst chart
     fig = px.sunburst(top_categories,
@@ -327,4 +483,6 @@ def plot_sunburst_chart(df,
                       width=1000)
     
     fig.update_traces(textinfo='label+percent entry')  # Display both label and percentage
+    if not show:
+        return fig
     fig.show()
\ No newline at end of file
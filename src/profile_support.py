@@ -0,0 +1,215 @@
+# Import the needed libraries
+
+import json
+import re
+import time
+import pandas as pd
+from src import db_support as dbs
+
+# Profiling of the multi CTE SQL files. On PostgreSQL the query runs under
+# EXPLAIN (ANALYZE, BUFFERS) and the report lists time, rows and buffer I/O of the whole query
+# and of every CTE the planner materialized. With per_cte=True each CTE is also run on its own
+# (with the CTEs it depends on), which shows where the time goes even for inlined CTEs.
+# Other databases (e.g. the local DuckDB stand-in) get wall clock time and row counts only.
+
+BUFFER_KEYS = {
+    'Shared Hit Blocks': 'shared_hit_blocks',
+    'Shared Read Blocks': 'shared_read_blocks',
+    'Temp Read Blocks': 'temp_read_blocks',
+    'Temp Written Blocks': 'temp_written_blocks',
+}
+
+
+def _skip_space_and_comments(sql, i):
+    while i < len(sql):
+        if sql[i].isspace():
+            i += 1
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end + 1
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = len(sql) if end == -1 else end + 2
+        else:
+            break
+    return i
+
+
+def _closing_paren(sql, i):
+    # i points at an opening parenthesis, returns the index of the matching closing one
+    depth = 0
+    while i < len(sql):
+        char = sql[i]
+        if char in ("'", '"'):
+            end = sql.find(char, i + 1)
+            while end != -1 and sql.startswith(char * 2, end):
+                end = sql.find(char, end + 2)
+            if end == -1:
+                break
+            i = end + 1
+            continue
+        if sql.startswith('--', i) or sql.startswith('/*', i):
+            i = _skip_space_and_comments(sql, i)
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise ValueError("unbalanced parentheses in SQL")
+
+
+def split_ctes(sql_query):
+    """
+    Split a `WITH a AS (...), b AS (...) SELECT ...` query into its CTEs and the final statement.
+
+    Returns:
+    - tuple (ctes, final_query): ctes is a list of (name, body) in definition order, final_query
+      the statement after the last CTE. A query without WITH gives ([], sql_query).
+    """
+    i = _skip_space_and_comments(sql_query, 0)
+    if not re.match(r'with\b', sql_query[i:], re.IGNORECASE):
+        return [], sql_query.strip().rstrip(';')
+    i += 4
+
+    ctes = []
+    while True:
+        i = _skip_space_and_comments(sql_query, i)
+        match = re.match(r'("[^"]+"|\w+)\s+as\s+(?:(?:not\s+)?materialized\s+)?\(', sql_query[i:], re.IGNORECASE)
+        if not match:
+            raise ValueError(f"could not parse the CTE starting at: {sql_query[i:i + 40]!r}")
+        name = match.group(1).strip('"')
+        start = i + match.end() - 1
+        end = _closing_paren(sql_query, start)
+        ctes.append((name, sql_query[start + 1:end].strip()))
+
+        i = _skip_space_and_comments(sql_query, end + 1)
+        if sql_query.startswith(',', i):
+            i += 1
+            continue
+        return ctes, sql_query[i:].strip().rstrip(';')
+
+
+def cte_dependencies(ctes):
+    """
+    Returns {cte name: [names of earlier CTEs it reads from]}.
+    """
+    dependencies = {}
+    for position, (name, body) in enumerate(ctes):
+        earlier = [other for other, _ in ctes[:position]]
+        dependencies[name] = [other for other in earlier if re.search(rf'\b{re.escape(other)}\b', body, re.IGNORECASE)]
+    return dependencies
+
+
+def _with_clause(ctes):
+    return 'WITH ' + ',\n'.join(f'{name} AS (\n{body}\n)' for name, body in ctes)
+
+
+def build_query(ctes, final_query):
+    """
+    Inverse of split_ctes: the query text from a list of (name, body) CTEs and the final statement.
+    """
+    return f'{_with_clause(ctes)}\n{final_query}' if ctes else final_query
+
+
+def _plan_metrics(node):
+    metrics = {
+        'execution_ms': node.get('Actual Total Time', 0.0) * node.get('Actual Loops', 1),
+        'rows': node.get('Actual Rows', 0) * node.get('Actual Loops', 1),
+    }
+    for key, column in BUFFER_KEYS.items():
+        metrics[column] = node.get(key, 0)
+    return metrics
+
+
+def _materialized_ctes(plan):
+    # Materialized CTEs show up as init plans named "CTE <name>"
+    found = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        subplan_name = node.get('Subplan Name', '')
+        if subplan_name.startswith('CTE '):
+            found.append({'cte': subplan_name[4:], **_plan_metrics(node)})
+        stack.extend(node.get('Plans', []))
+    return pd.DataFrame(found, columns=['cte', 'execution_ms', 'rows'] + list(BUFFER_KEYS.values()))
+
+
+def explain_analyze(sql_query):
+    """
+    Run a query under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on PostgreSQL, or time it on
+    other databases.
+
+    Returns:
+    - dict with execution_ms, planning_ms, rows, the buffer block counts (None outside
+      PostgreSQL) and the raw JSON plan.
+    """
+    with dbs.connect() as connection:
+        if connection.dialect.name != 'postgresql':
+            start = time.perf_counter()
+            rows = len(connection.exec_driver_sql(sql_query).fetchall())
+            metrics = {'execution_ms': (time.perf_counter() - start) * 1000, 'planning_ms': None, 'rows': rows}
+            return {**metrics, **{column: None for column in BUFFER_KEYS.values()}, 'plan': None}
+
+        result = connection.exec_driver_sql(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql_query}').scalar()
+
+    explained = (json.loads(result) if isinstance(result, str) else result)[0]
+    metrics = _plan_metrics(explained['Plan'])
+    metrics['execution_ms'] = explained.get('Execution Time', metrics['execution_ms'])
+    metrics['planning_ms'] = explained.get('Planning Time')
+    return {**metrics, 'plan': explained['Plan']}
+
+
+def profile_sql(sql_query, per_cte=False):
+    """
+    Profile a query and its CTEs.
+
+    Parameters:
+    - sql_query (str): query text, e.g. the content of SQL/All_info_combined.sql.
+    - per_cte (bool): also run every CTE on its own. Each CTE run includes the CTEs it depends
+      on, so execution_ms is cumulative; incremental_ms subtracts the slowest direct dependency
+      as an estimate of the CTE's own cost.
+
+    Returns:
+    - dict with 'query' (metrics of the whole query), 'materialized_ctes' (DataFrame of the CTEs
+      the planner materialized, PostgreSQL only), 'ctes' (DataFrame of the per CTE runs, None
+      without per_cte) and 'plan' (raw JSON plan).
+    """
+    sql_query = sql_query.strip().rstrip(';')
+    total = explain_analyze(sql_query)
+    plan = total.pop('plan')
+    report = {
+        'query': total,
+        'materialized_ctes': _materialized_ctes(plan) if plan else None,
+        'ctes': None,
+        'plan': plan,
+    }
+
+    if per_cte:
+        ctes, _ = split_ctes(sql_query)
+        dependencies = cte_dependencies(ctes)
+        rows = []
+        for position, (name, _) in enumerate(ctes):
+            metrics = explain_analyze(f'{_with_clause(ctes[:position + 1])}\nSELECT * FROM {name}')
+            metrics.pop('plan')
+            rows.append({'cte': name, 'depends_on': dependencies[name], **metrics})
+
+        cte_report = pd.DataFrame(rows)
+        cumulative = cte_report.set_index('cte')['execution_ms']
+        cte_report['incremental_ms'] = [
+            max(0.0, cumulative[name] - max((cumulative[dependency] for dependency in dependencies[name]), default=0.0))
+            for name in cte_report['cte']
+        ]
+        report['ctes'] = cte_report
+
+    return report
+
+
+def profile_sql_file(sql_file_path, per_cte=False):
+    """
+    Profile a SQL file, see profile_sql.
+    """
+    with open(sql_file_path, 'r') as file:
+        return profile_sql(file.read(), per_cte=per_cte)
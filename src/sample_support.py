@@ -0,0 +1,243 @@
+# Import the needed libraries
+
+import numpy as np
+import pandas as pd
+from src import profile_support as prof
+from src.lazy_support import lazy_import
+
+# scipy is only needed for the confidence intervals
+stats = lazy_import('scipy.stats')
+
+# Sampling mode for the exploratory profiling. sample_query rewrites a SQL file so it only
+# reads a sample of the users: by default a hash based sample stratified by home_country
+# (every country keeps its share, small countries keep at least min_per_stratum users), or a
+# TABLESAMPLE BERNOULLI sample. The result gets a sampling_weight column (users represented by
+# each sampled user) and the profiling helpers turn the sample back into the distributions of
+# the full base with confidence intervals.
+
+COHORT_CTE = 'UserSessions'
+SAMPLE_CTE = 'sampled_users'
+POPULATION_CTE = 'cohort_users'
+PROFILE_CATEGORIES = ['age_group', 'gender', 'married', 'has_children', 'home_country']
+PROFILE_NUMERIC = ['age']
+
+# Users are ranked within their country by md5('user_id/seed') (md5 exists in PostgreSQL and
+# DuckDB): the same seed always gives the same users, and as the seed is hashed together with the
+# id every seed gives an unrelated order, so samples of different seeds are independent draws
+HASH_EXPRESSION = "md5(CAST(u.user_id AS VARCHAR) || '/{seed}')"
+
+
+def sampled_users_sql(fraction, seed=0, strata_column='home_country', min_per_stratum=1, method='hash',
+                      dialect='postgresql', cohort=None):
+    """
+    SELECT of the sampled user_id and their sampling_weight.
+
+    Parameters:
+    - fraction (float): share of the users to keep, between 0 and 1.
+    - seed (int): changes the sample, the same seed gives the same users.
+    - strata_column (str): users column to stratify by (method='hash'), None for no strata.
+    - min_per_stratum (int): users kept at least in every stratum (method='hash').
+    - method (str): 'hash' for the stratified hash sample, 'tablesample' for a Bernoulli
+      TABLESAMPLE (faster on very large tables, not stratified, the size varies a little).
+    - dialect (str): database dialect name, TABLESAMPLE is written differently on DuckDB.
+    - cohort (str): table or CTE with the user_id of the population to sample (method='hash'),
+      None for every user. The strata are counted inside the cohort, so the weights add up to it.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError(f"fraction must be in (0, 1], got {fraction}")
+    fraction, seed, min_per_stratum = float(fraction), int(seed), int(min_per_stratum)
+
+    if method == 'tablesample':
+        if dialect == 'duckdb':
+            sample = f"users USING SAMPLE {fraction * 100}% (bernoulli, {seed})"
+        else:
+            sample = f"users TABLESAMPLE BERNOULLI ({fraction * 100}) REPEATABLE ({seed})"
+        return f"SELECT user_id, {1 / fraction} AS sampling_weight FROM {sample}"
+    if method != 'hash':
+        raise ValueError(f"method must be 'hash' or 'tablesample', got {method!r}")
+
+    partition = f"PARTITION BY u.{strata_column} " if strata_column else ""
+    population = f"{cohort} c JOIN users u ON u.user_id = c.user_id" if cohort else "users u"
+    return f"""SELECT user_id, stratum_users * 1.0 / stratum_sample AS sampling_weight
+  FROM (
+    SELECT
+      u.user_id,
+      ROW_NUMBER() OVER ({partition}ORDER BY {HASH_EXPRESSION.format(seed=seed)}, u.user_id) AS stratum_rank,
+      COUNT(*) OVER ({partition.strip()}) AS stratum_users,
+      LEAST(COUNT(*) OVER ({partition.strip()}),
+            GREATEST({min_per_stratum}, CEIL({fraction} * COUNT(*) OVER ({partition.strip()})))) AS stratum_sample
+    FROM {population}
+  ) ranked
+  WHERE stratum_rank <= stratum_sample"""
+
+
+def sample_query(sql_query, fraction, seed=0, strata_column='home_country', min_per_stratum=1, method='hash',
+                 dialect='postgresql'):
+    """
+    Rewrite a query of the SQL folder so it only reads the sampled users.
+
+    The user cohort CTE (UserSessions, used by All_Data.sql and All_info_combined.sql) is
+    kept as cohort_users, the sample is drawn inside it (strata counted over the cohort) and
+    UserSessions is restricted to the sampled users, so the heavy CTEs after it only aggregate
+    their sessions, and every row gets the sampling_weight of its user. See sampled_users_sql
+    for the options.
+    """
+    ctes, final_query = prof.split_ctes(sql_query)
+    if COHORT_CTE not in [name for name, _ in ctes]:
+        raise ValueError(f"the query has no {COHORT_CTE} CTE to sample")
+    users_sql = sampled_users_sql(fraction, seed, strata_column, min_per_stratum, method, dialect,
+                                  cohort=POPULATION_CTE)
+    sampled_ctes = []
+    for name, body in ctes:
+        if name == COHORT_CTE:
+            sampled_ctes += [
+                (POPULATION_CTE, body),
+                (SAMPLE_CTE, users_sql),
+                (name, f"SELECT * FROM {POPULATION_CTE} cohort "
+                       f"WHERE cohort.user_id IN (SELECT user_id FROM {SAMPLE_CTE})"),
+            ]
+        else:
+            sampled_ctes.append((name, body))
+    ctes = sampled_ctes
+    final_query = (f"SELECT sampled.*, {SAMPLE_CTE}.sampling_weight\nFROM (\n{final_query}\n) sampled\n"
+                   f"JOIN {SAMPLE_CTE} ON {SAMPLE_CTE}.user_id = sampled.user_id")
+    return prof.build_query(ctes, final_query)
+
+
+def _users(df, weight_column, unique_column):
+    # One row per user (All_Data.sql has one row per session) and the weights, 1 without a sample
+    if unique_column and unique_column in df:
+        df = df.drop_duplicates(unique_column)
+    weights = df[weight_column].astype(float) if weight_column in df else pd.Series(1.0, index=df.index)
+    return df, weights
+
+
+def _weighted_mean_ci(values, weights, strata, confidence):
+    # Weighted mean (a proportion for 0/1 values) and its confidence interval by Taylor
+    # linearization for a stratified sample, with the finite population correction 1 - n_h / N_h
+    mask = values.notna()
+    values, weights, strata = values[mask].astype(float), weights[mask], strata[mask]
+    total_weight = weights.sum()
+    if total_weight == 0:
+        return np.nan, np.nan, np.nan
+    estimate = (weights * values).sum() / total_weight
+    scores = weights * (values - estimate) / total_weight
+    grouped = pd.DataFrame({'score': scores, 'stratum': strata, 'weight': weights}).groupby('stratum', observed=True)
+    n = grouped['score'].transform('size')
+    deviations = (scores - grouped['score'].transform('mean')) ** 2
+    finite = (1 - 1 / weights).clip(lower=0)
+    variance = (deviations * finite * n / (n - 1).where(n > 1)).fillna(0).sum()
+    margin = stats.norm.ppf(0.5 + confidence / 2) * np.sqrt(variance)
+    return estimate, estimate - margin, estimate + margin
+
+
+def _weighted_median(values, weights):
+    order = np.argsort(values)
+    values, weights = values[order], weights[order]
+    cumulative = np.cumsum(weights)
+    return values[np.searchsorted(cumulative, cumulative[-1] / 2)]
+
+
+def _bootstrap(values, weights, strata, statistic, confidence, n_boot, seed):
+    # Resample users with replacement inside every stratum, like the sample was drawn
+    mask = ~np.isnan(values)
+    values, weights, strata = values[mask], weights[mask], strata[mask]
+    rng = np.random.default_rng(seed)
+    groups = [np.flatnonzero(strata == stratum) for stratum in np.unique(strata)]
+    estimates = np.empty(n_boot)
+    for draw in range(n_boot):
+        index = np.concatenate([rng.choice(group, size=len(group)) for group in groups])
+        estimates[draw] = statistic(values[index], weights[index])
+    alpha = (1 - confidence) / 2
+    return statistic(values, weights), np.quantile(estimates, alpha), np.quantile(estimates, 1 - alpha)
+
+
+def value_counts_ci(df, column, weight_column='sampling_weight', strata_column='home_country', confidence=0.95,
+                    method='analytic', n_boot=1000, seed=0, unique_column='user_id'):
+    """
+    Estimated value_counts of a column over the full base, with confidence intervals.
+
+    Parameters:
+    - df (pd.DataFrame): sampled result (with sampling_weight), or the full data.
+    - column (str): column to count, e.g. 'age_group'.
+    - weight_column (str): column with the sampling weights, missing means weight 1.
+    - strata_column (str): column the sample was stratified by, None for a simple sample.
+    - confidence (float): level of the intervals.
+    - method (str): 'analytic' (linearization, instant) or 'bootstrap' (stratified bootstrap).
+    - n_boot (int), seed (int): bootstrap draws and seed.
+    - unique_column (str): one row per value of this column is kept (users, not sessions).
+
+    Returns:
+    - pd.DataFrame with value, count (estimated users), proportion, ci_low and ci_high (of the
+      proportion) and sample_count, sorted like value_counts.
+    """
+    df, weights = _users(df, weight_column, unique_column)
+    strata = df[strata_column].astype(str) if strata_column and strata_column in df else pd.Series('all', index=df.index)
+    values = df[column].astype(object).where(df[column].notna(), 'NULL')
+
+    rows = []
+    for value in values.unique():
+        indicator = (values == value).astype(float)
+        if method == 'bootstrap':
+            estimate, low, high = _bootstrap(indicator.to_numpy(), weights.to_numpy(), strata.to_numpy(),
+                                             lambda v, w: (v * w).sum() / w.sum(), confidence, n_boot, seed)
+        else:
+            estimate, low, high = _weighted_mean_ci(indicator, weights, strata, confidence)
+        rows.append({'value': value, 'count': weights[indicator == 1].sum(), 'proportion': estimate,
+                     'ci_low': max(low, 0.0), 'ci_high': min(high, 1.0), 'sample_count': int(indicator.sum())})
+    return pd.DataFrame(rows).sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def numeric_ci(df, column, weight_column='sampling_weight', strata_column='home_country', confidence=0.95,
+               method='analytic', n_boot=1000, seed=0, unique_column='user_id'):
+    """
+    Estimated mean and median of a numeric column (e.g. age) with confidence intervals.
+    The median always uses the bootstrap. See value_counts_ci for the parameters.
+
+    Returns:
+    - pd.DataFrame with statistic (mean, median), estimate, ci_low and ci_high.
+    """
+    df, weights = _users(df, weight_column, unique_column)
+    strata = df[strata_column].astype(str) if strata_column and strata_column in df else pd.Series('all', index=df.index)
+    values = pd.to_numeric(df[column], errors='coerce').astype(float)
+
+    if method == 'bootstrap':
+        mean = _bootstrap(values.to_numpy(), weights.to_numpy(), strata.to_numpy(),
+                          lambda v, w: (v * w).sum() / w.sum(), confidence, n_boot, seed)
+    else:
+        mean = _weighted_mean_ci(values, weights, strata, confidence)
+    median = _bootstrap(values.to_numpy(), weights.to_numpy(), strata.to_numpy(), _weighted_median, confidence,
+                        n_boot, seed)
+    return pd.DataFrame([('mean', *mean), ('median', *median)], columns=['statistic', 'estimate', 'ci_low', 'ci_high'])
+
+
+def profile_sample(df, categories=PROFILE_CATEGORIES, numeric=PROFILE_NUMERIC, weight_column='sampling_weight',
+                   strata_column='home_country', confidence=0.95, method='analytic', n_boot=1000, seed=0,
+                   unique_column='user_id'):
+    """
+    The exploratory profile (value_counts of the categorical columns, mean and median age,
+    describe) estimated from a sample.
+
+    Returns:
+    - dict with 'value_counts' (tidy DataFrame: column, value, count, proportion, ci_low,
+      ci_high, sample_count), 'numeric' (column, statistic, estimate, ci_low, ci_high) and
+      'describe' (describe(include='all') of the sampled users, unweighted).
+    """
+    options = dict(weight_column=weight_column, strata_column=strata_column, confidence=confidence, method=method,
+                   n_boot=n_boot, seed=seed, unique_column=unique_column)
+
+    def tidy(function, columns):
+        frames = []
+        for column in columns:
+            if column in df:
+                frame = function(df, column, **options)
+                frame.insert(0, 'column', column)
+                frames.append(frame)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    users, _ = _users(df, weight_column, unique_column)
+    return {
+        'value_counts': tidy(value_counts_ci, categories),
+        'numeric': tidy(numeric_ci, numeric),
+        'describe': users.drop(columns=[weight_column], errors='ignore').describe(include='all'),
+    }
@@ -0,0 +1,100 @@
+# Import the needed libraries
+
+import numpy as np
+import pandas as pd
+
+# Declared dtypes of the combined user feature frame (All_info_combined.sql plus the notebook's
+# flight_hunter_index and cluster columns). The default frame keeps the strings as object and
+# every metric as float64; with the schema the low cardinality strings become categoricals,
+# the flags booleans, the counts int32 and the metrics float32, which takes a fraction of the
+# memory and makes every .copy() / get_dummies of the notebook cheaper too.
+
+COUNT_COLUMNS = ['user_id', 'total_trips', 'total_cancellations', 'total_sessions', 'total_clicks', 'total_nights',
+                 'cluster']
+FLAG_COLUMNS = ['married', 'has_children']
+CATEGORY_COLUMNS = ['gender', 'home_country', 'home_city', 'age_group', 'cluster_label']
+DATE_COLUMNS = ['birthdate', 'latest_session']
+METRIC_COLUMNS = [
+    'age', 'total_cancellation_rate', 'average_checked_bags', 'prefers_flights', 'prefers_hotels',
+    'prefers_both', 'conversion_rate', 'average_clicks', 'click_efficiency', 'average_hotel_discount',
+    'average_flight_discount', 'flight_discount_proportion', 'hotel_discount_proportion',
+    'both_discount_proportion', 'discount_responsiveness', 'total_hotel_usd_spent', 'total_flight_usd_spent',
+    'total_usd_spent', 'avg_nights', 'scaled_hotel_ads', 'ads_per_km', 'scaled_ads_per_km', 'hotel_hunter_index',
+    'flight_hunter_index',
+]
+
+COMBINED_SCHEMA = {
+    **{column: 'int32' for column in COUNT_COLUMNS},
+    **{column: 'bool' for column in FLAG_COLUMNS},
+    **{column: 'category' for column in CATEGORY_COLUMNS},
+    **{column: 'datetime64[ns]' for column in DATE_COLUMNS},
+    **{column: 'float32' for column in METRIC_COLUMNS},
+}
+
+
+def _convert(series, dtype):
+    has_nulls = series.isna().any()
+    if dtype == 'bool':
+        # NULL flags stay NULL in the nullable boolean dtype instead of turning into False
+        return series.astype('boolean' if has_nulls else bool)
+    if dtype in ('int32', 'int16', 'int8'):
+        if has_nulls:
+            return series.astype(dtype.capitalize())
+        return series.astype(dtype)
+    if dtype == 'datetime64[ns]':
+        return pd.to_datetime(series)
+    return series.astype(dtype)
+
+
+def apply_schema(df, schema=None, downcast_floats=True, max_category_ratio=0.5):
+    """
+    Convert a DataFrame to the declared dtypes.
+
+    Parameters:
+    - df (pd.DataFrame): frame to convert, e.g. the result of execute_sql_file.
+    - schema (dict): column name to dtype ('category', 'bool', 'int32', 'float32', ...), default
+      COMBINED_SCHEMA. Columns not in the frame are ignored.
+    - downcast_floats (bool): also turn undeclared float64 columns (e.g. the *_scaled features or
+      get_dummies output) into float32.
+    - max_category_ratio (float): undeclared object columns become categoricals when their number
+      of distinct values is at most this share of the rows. None leaves them as they are.
+
+    Returns:
+    - converted copy of df.
+    """
+    schema = COMBINED_SCHEMA if schema is None else schema
+    converted = {}
+    for column in df.columns:
+        series = df[column]
+        if column in schema:
+            converted[column] = _convert(series, schema[column])
+        elif downcast_floats and series.dtype == np.float64:
+            converted[column] = series.astype('float32')
+        elif (max_category_ratio is not None and series.dtype == object and len(series)
+              and series.nunique() <= max_category_ratio * len(series)):
+            converted[column] = series.astype('category')
+        else:
+            converted[column] = series
+    return pd.DataFrame(converted, index=df.index)
+
+
+def memory_report(before, after):
+    """
+    Memory used per column before and after apply_schema.
+
+    Returns:
+    - pd.DataFrame indexed by column with dtype_before, dtype_after, bytes_before, bytes_after,
+      bytes_saved and saved_pct, plus a 'total' row.
+    """
+    bytes_before = before.memory_usage(deep=True, index=False)
+    bytes_after = after.memory_usage(deep=True, index=False).reindex(bytes_before.index)
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.reindex(before.columns).astype(str),
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+    })
+    report.loc['total'] = ['', '', bytes_before.sum(), bytes_after.sum()]
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    report['saved_pct'] = (100 * report['bytes_saved'] / report['bytes_before'].where(report['bytes_before'] > 0)).round(1)
+    return report
@@ -0,0 +1,289 @@
+# Import the needed libraries
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from src import cluster_support as cls
+
+# Perk assignment for new users without re-running the notebook. PerkScorer loads the bundle
+# saved by cluster_support.save_model (scaler, centroids and label map) and labels feature rows
+# with a vectorized nearest centroid. serve() puts it behind a small local HTTP endpoint; the
+# requests that arrive together are scored as one batch by a single worker thread.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Seconds a request waits for its batch before the endpoint answers 503
+DEFAULT_TIMEOUT = 10
+# Connections waiting to be accepted, the socketserver default of 5 resets bursts of clients
+DEFAULT_BACKLOG = 128
+
+
+class PerkScorer:
+    """
+    Assign perks to feature rows with a saved segmentation model.
+
+    Parameters:
+    - bundle: dict from cluster_support.load_model, or the path of a saved model.
+    """
+
+    def __init__(self, bundle=cls.DEFAULT_MODEL_PATH):
+        if isinstance(bundle, str):
+            bundle = cls.load_model(bundle)
+        self.features = bundle['features']
+        self.scaler = bundle['scaler']
+        self.centroids = np.asarray(bundle['centroids'])
+        self.labels = bundle['labels']
+
+    def score(self, rows):
+        """
+        Perk of each row.
+
+        Parameters:
+        - rows: DataFrame, list of dicts or a single dict with the model features (or the SQL
+          columns flight_hunter_index is derived from).
+
+        Returns:
+        - pd.DataFrame with cluster and cluster_label, aligned with the rows (plus user_id when
+          the rows have it).
+
+        Raises ValueError naming the features that are missing or null, nothing is scored then.
+        """
+        if isinstance(rows, dict):
+            rows = [rows]
+        rows = pd.DataFrame(rows)
+        try:
+            features = cls.prepare_features(rows, self.features)
+        except KeyError as error:
+            raise ValueError(f"missing model features: {error}") from None
+        missing = features.columns[features.isna().any()].tolist()
+        if missing:
+            raise ValueError(f"null or missing values in the model features {missing}")
+        scaled = self.scaler.transform(features)
+        clusters = cls.nearest_centroid(scaled, self.centroids)
+        scores = pd.DataFrame({'cluster': clusters}, index=rows.index)
+        scores['cluster_label'] = scores['cluster'].map(self.labels)
+        if 'user_id' in rows:
+            scores.insert(0, 'user_id', rows['user_id'])
+        return scores
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent requests, in milliseconds.
+    """
+
+    def __init__(self, window=10000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def record(self, milliseconds):
+        with self._lock:
+            self._latencies.append(milliseconds)
+            self.requests += 1
+
+    def percentiles(self, quantiles=(50, 90, 99)):
+        """
+        Returns {'requests': total, 'p50_ms': ..., ...} over the recent window.
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            requests = self.requests
+        stats = {'requests': requests}
+        for quantile in quantiles:
+            stats[f'p{quantile}_ms'] = float(np.percentile(latencies, quantile)) if len(latencies) else None
+        return stats
+
+
+class MicroBatcher:
+    """
+    Score concurrent requests together: requests queue up while a batch is scored and the next
+    batch takes everything waiting, up to max_batch rows, after at most max_wait_ms.
+
+    Parameters:
+    - scorer (PerkScorer): model used for the batches.
+    - max_batch (int): rows per batch.
+    - max_wait_ms (float): time the first request of a batch waits for others to join.
+    - timeout (float): seconds score() waits for a result before raising TimeoutError.
+    """
+
+    def __init__(self, scorer, max_batch=4096, max_wait_ms=2, timeout=DEFAULT_TIMEOUT):
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """
+        Queue rows (list of dicts) for scoring, returns a Future of the scores DataFrame.
+        Raises ValueError for anything else, so a bad request never reaches the worker.
+        """
+        if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("rows must be a non-empty list of JSON objects")
+        future = Future()
+        self._queue.put((rows, future))
+        return future
+
+    def score(self, rows, timeout=None):
+        """
+        Scores of rows, waits at most timeout seconds (self.timeout by default) and raises
+        TimeoutError after that. A request that times out before its batch starts is dropped.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(rows)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"no result after {timeout} seconds") from None
+
+    def _take(self, item, batch):
+        # Keep the request unless it was cancelled, it cannot be cancelled afterwards
+        if item[1].set_running_or_notify_cancel():
+            batch.append(item)
+            return len(item[0])
+        return 0
+
+    def _next_batch(self):
+        batch = []
+        while not batch:
+            size = self._take(self._queue.get(), batch)
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            size += self._take(item, batch)
+        return batch
+
+    def _score_batch(self, batch):
+        try:
+            scores = self.scorer.score([row for rows, _ in batch for row in rows])
+        except Exception:
+            # A bad row fails its whole batch, score the requests one by one to isolate it
+            for rows, future in batch:
+                try:
+                    future.set_result(self.scorer.score(rows))
+                except Exception as request_error:
+                    future.set_exception(request_error)
+            return
+
+        start = 0
+        for rows, future in batch:
+            future.set_result(scores.iloc[start:start + len(rows)].reset_index(drop=True))
+            start += len(rows)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._score_batch(batch)
+            except Exception as error:
+                # The worker must outlive any batch, the requests still waiting get the error
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+
+def make_handler(batcher, latencies):
+    """
+    Request handler class for ThreadingHTTPServer:
+    - POST /score with a JSON object or list of objects (or {"rows": [...]}) returns
+      {"scores": [{"cluster": ..., "cluster_label": ...}, ...]} in the same order. Invalid
+      JSON or rows answer 400, a batch that is not scored within the batcher timeout 503.
+    - GET /stats returns the request count and latency percentiles.
+    - GET /health returns {"status": "ok"}.
+    """
+    class ScoreHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, latencies.percentiles())
+            elif self.path == '/health':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._reply(404, {'error': 'not found'})
+                return
+            start = time.perf_counter()
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                rows = payload['rows'] if isinstance(payload, dict) and 'rows' in payload else payload
+                rows = [rows] if isinstance(rows, dict) else rows
+                scores = batcher.score(rows)
+            except TimeoutError as error:
+                self._reply(503, {'error': str(error)})
+                return
+            except Exception as error:
+                self._reply(400, {'error': str(error)})
+                return
+            records = json.loads(scores.to_json(orient='records'))
+            self._reply(200, {'scores': records})
+            latencies.record((time.perf_counter() - start) * 1000)
+
+        def log_message(self, format, *args):
+            # Keep the console quiet, /stats has the numbers
+            pass
+
+    return ScoreHandler
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer with a listen backlog of request_queue_size connections.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, request_queue_size=DEFAULT_BACKLOG):
+        # Set before the base class binds and listens
+        self.request_queue_size = request_queue_size
+        super().__init__(server_address, handler_class)
+
+
+def serve(model_path=cls.DEFAULT_MODEL_PATH, host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=4096, max_wait_ms=2,
+          timeout=DEFAULT_TIMEOUT, backlog=DEFAULT_BACKLOG):
+    """
+    Start the scoring endpoint, returns the server (call serve_forever() on it, or shutdown()).
+    backlog is the number of connections the socket queues before clients are reset.
+    """
+    batcher = MicroBatcher(PerkScorer(model_path), max_batch=max_batch, max_wait_ms=max_wait_ms, timeout=timeout)
+    return ScoringServer((host, port), make_handler(batcher, LatencyTracker()), request_queue_size=backlog)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve perk assignments for TravelTide users.')
+    parser.add_argument('--model', default=cls.DEFAULT_MODEL_PATH)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch', type=int, default=4096)
+    parser.add_argument('--max-wait-ms', type=float, default=2)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG)
+    arguments = parser.parse_args()
+
+    server = serve(arguments.model, arguments.host, arguments.port, arguments.max_batch, arguments.max_wait_ms,
+                   arguments.timeout, arguments.backlog)
+    print(f'Scoring on http://{arguments.host}:{arguments.port}/score')
+    server.serve_forever()
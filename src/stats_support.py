@@ -0,0 +1,153 @@
+# Import the needed libraries
+
+import numpy as np
+import pandas as pd
+
+# Correlation analysis over chunks. Every chunk adds its pairwise counts, sums, sums of squares
+# and co-moments to a CorrelationAccumulator; accumulators of different chunks (or processes)
+# merge, and corr() gives the same matrix as DataFrame.corr() on the whole frame, NULLs
+# excluded pair by pair. The values are kept relative to a shift (the column means of the first
+# chunk) so the sums stay small and the co-moments do not lose precision.
+
+
+class CorrelationAccumulator:
+    """
+    Mergeable running sums and co-moments of a set of numeric columns.
+
+    Parameters:
+    - columns (list): columns to correlate, default the numeric columns of the first chunk.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = None if columns is None else list(columns)
+        self.shift = None
+
+    def _start(self, shift):
+        k = len(self.columns)
+        self.shift = shift
+        self.n = np.zeros((k, k))
+        self.sum_x = np.zeros((k, k))
+        self.sum_xx = np.zeros((k, k))
+        self.sum_xy = np.zeros((k, k))
+
+    def update(self, chunk):
+        """
+        Add a DataFrame chunk, returns self.
+        """
+        if self.columns is None:
+            self.columns = chunk.select_dtypes(include=['number', 'bool']).columns.tolist()
+        values = chunk[self.columns].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        if self.shift is None:
+            counts = valid.sum(axis=0)
+            self._start(np.where(counts > 0, np.nansum(values, axis=0) / np.maximum(counts, 1), 0.0))
+
+        # [i, j] entries only use the rows where both column i and column j are not NULL
+        centered = np.where(valid, values - self.shift, 0.0)
+        mask = valid.astype(float)
+        self.n += mask.T @ mask
+        self.sum_x += centered.T @ mask
+        self.sum_xx += (centered ** 2).T @ mask
+        self.sum_xy += centered.T @ centered
+        return self
+
+    def _shifted(self, shift):
+        # Sums of this accumulator relative to another shift
+        delta = self.shift - shift
+        sum_x = self.sum_x + self.n * delta[:, None]
+        sum_xx = self.sum_xx + 2 * delta[:, None] * self.sum_x + self.n * delta[:, None] ** 2
+        sum_xy = (self.sum_xy + self.sum_x * delta[None, :] + self.sum_x.T * delta[:, None]
+                  + self.n * np.outer(delta, delta))
+        return sum_x, sum_xx, sum_xy
+
+    def merge(self, other):
+        """
+        Add the sums of another accumulator over the same columns, returns self.
+        """
+        if other.shift is None:
+            return self
+        if self.shift is None:
+            self.columns = other.columns
+            self._start(other.shift.copy())
+        elif other.columns != self.columns:
+            raise ValueError("accumulators cover different columns")
+
+        sum_x, sum_xx, sum_xy = other._shifted(self.shift)
+        self.n += other.n
+        self.sum_x += sum_x
+        self.sum_xx += sum_xx
+        self.sum_xy += sum_xy
+        return self
+
+    def corr(self, min_periods=1):
+        """
+        Pearson correlation matrix as a DataFrame, like DataFrame.corr(min_periods=...).
+        """
+        if self.shift is None:
+            raise ValueError("no data added yet")
+        n = self.n
+        covariance = n * self.sum_xy - self.sum_x * self.sum_x.T
+        variance_x = n * self.sum_xx - self.sum_x ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = covariance / np.sqrt(variance_x * variance_x.T)
+        correlation[(n < max(min_periods, 2)) | (variance_x <= 0) | (variance_x.T <= 0)] = np.nan
+        correlation = np.clip(correlation, -1, 1)
+        return pd.DataFrame(correlation, index=self.columns, columns=self.columns)
+
+
+def streaming_corr(chunks, columns=None, min_periods=1):
+    """
+    Correlation matrix of a stream of DataFrame chunks, e.g.
+    dbs.execute_sql_file(path, chunksize=100000).
+    """
+    accumulator = CorrelationAccumulator(columns)
+    for chunk in chunks:
+        accumulator.update(chunk)
+    return accumulator.corr(min_periods)
+
+
+def correlation_pairs(correlation_matrix, threshold=None):
+    """
+    Upper triangle of a correlation matrix as a tidy table, one row per pair of features.
+
+    Parameters:
+    - correlation_matrix (pd.DataFrame): square correlation matrix.
+    - threshold (float): keep the pairs whose absolute correlation is above it, None for all pairs.
+
+    Returns:
+    - pd.DataFrame with feature_1, feature_2, correlation and abs_correlation, sorted by
+      abs_correlation descending.
+    """
+    values = correlation_matrix.to_numpy(dtype=float)
+    rows, cols = np.triu_indices(len(correlation_matrix.columns), k=1)
+    correlation = values[rows, cols]
+    keep = ~np.isnan(correlation)
+    if threshold is not None:
+        keep &= np.abs(correlation) > threshold
+
+    labels = correlation_matrix.columns.to_numpy()
+    pairs = pd.DataFrame({
+        'feature_1': labels[rows[keep]],
+        'feature_2': labels[cols[keep]],
+        'correlation': correlation[keep],
+        'abs_correlation': np.abs(correlation[keep]),
+    })
+    return pairs.sort_values('abs_correlation', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def pairs_to_matrix(pairs, columns=None):
+    """
+    Symmetric correlation matrix from a correlation_pairs table, 1 on the diagonal and NaN for
+    the pairs not in the table.
+    """
+    if columns is None:
+        columns = pd.unique(pairs[['feature_1', 'feature_2']].to_numpy().ravel())
+    columns = list(columns)
+    positions = {column: position for position, column in enumerate(columns)}
+    rows = pairs['feature_1'].map(positions).to_numpy()
+    cols = pairs['feature_2'].map(positions).to_numpy()
+    values = np.full((len(columns), len(columns)), np.nan)
+    values[rows, cols] = pairs['correlation'].to_numpy()
+    values[cols, rows] = pairs['correlation'].to_numpy()
+    np.fill_diagonal(values, 1.0)
+    return pd.DataFrame(values, index=columns, columns=columns)
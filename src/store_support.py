@@ -0,0 +1,135 @@
+# Import the needed libraries
+
+import os
+from datetime import date
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+# Columnar feature store for the final user table (needs pyarrow). Instead of one CSV that every
+# downstream job parses in full, the features are written as a Parquet (or Feather / Arrow IPC)
+# dataset partitioned in hive style folders, e.g. feature_store/run_date=2024-01-31/
+# cluster_label=Free Checked Bag/part-0.parquet. Readers load only the columns and partitions
+# they ask for, and keep the dtypes.
+
+DEFAULT_STORE_DIR = 'feature_store'
+DEFAULT_PARTITIONS = ['run_date', 'cluster_label']
+FORMATS = {'parquet': 'parquet', 'feather': 'ipc', 'ipc': 'ipc'}
+
+
+def _dataset_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt must be one of {sorted(FORMATS)}, got {fmt!r}")
+    return FORMATS[fmt]
+
+
+def store_layout(store_dir=DEFAULT_STORE_DIR):
+    """
+    Partition columns of the files already in the store, in folder order, e.g.
+    ('run_date', 'cluster_label'). None for an empty or missing store.
+
+    Raises ValueError when the files do not share one layout (e.g. unpartitioned files next to
+    partition folders), such a store would return some rows twice.
+    """
+    layouts = set()
+    for folder, _, file_names in os.walk(store_dir):
+        # pyarrow skips the files starting with . or _ too
+        if any(not name.startswith(('.', '_')) for name in file_names):
+            parts = os.path.relpath(folder, store_dir).split(os.sep)
+            layouts.add(tuple(part.split('=', 1)[0] for part in parts if part != '.'))
+    if len(layouts) > 1:
+        raise ValueError(f"{store_dir} mixes partition layouts {sorted(layouts)}, rebuild it")
+    return layouts.pop() if layouts else None
+
+
+def write_features(df, store_dir=DEFAULT_STORE_DIR, run_date=None, partition_cols=DEFAULT_PARTITIONS, fmt='parquet',
+                   csv_path=None):
+    """
+    Write the feature table to the store.
+
+    Parameters:
+    - df (pd.DataFrame): feature table, e.g. the notebook's final df.
+    - store_dir (str): root folder of the dataset.
+    - run_date: date of the run, stored as the run_date partition (ISO string), today by default.
+    - partition_cols (list): columns to partition by, in folder order. run_date is always the
+      first one; columns missing from df are skipped.
+    - fmt (str): 'parquet' or 'feather' (Arrow IPC, fastest to memory map).
+    - csv_path (str): also export the table to this CSV file, like the old Final_output.csv.
+
+    Rewriting a partition (same run_date and cluster_label) replaces its files, other partitions
+    are kept. A write whose partition columns differ from the files already in the store raises
+    ValueError, write it to another store_dir.
+
+    Returns:
+    - store_dir.
+    """
+    df = df.copy()
+    df['run_date'] = pd.Timestamp(date.today() if run_date is None else run_date).date().isoformat()
+    partition_cols = ['run_date'] + [column for column in partition_cols if column in df.columns and column != 'run_date']
+
+    layout = store_layout(store_dir)
+    if layout is not None and layout != tuple(partition_cols):
+        raise ValueError(f"{store_dir} is partitioned by {list(layout)}, not {partition_cols}")
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    partitioning = ds.partitioning(table.select(partition_cols).schema, flavor='hive')
+    ds.write_dataset(table, store_dir, format=_dataset_format(fmt), partitioning=partitioning,
+                     existing_data_behavior='delete_matching')
+
+    if csv_path:
+        os.makedirs(os.path.dirname(os.path.abspath(csv_path)), exist_ok=True)
+        df.drop(columns=['run_date'], errors='ignore').to_csv(csv_path, index=False)
+    return store_dir
+
+
+def _filter_expression(filters):
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    # [(column, op, value), ...] (AND) or [[...], [...]] (OR of ANDs), like pandas.read_parquet
+    return pq.filters_to_expression(filters)
+
+
+def open_features(store_dir=DEFAULT_STORE_DIR, fmt='parquet', memory_map=True):
+    """
+    Open the store as a pyarrow dataset, for scans that do not fit in a DataFrame.
+    Partition columns are read as dictionaries (categoricals in pandas).
+    """
+    filesystem = fs.LocalFileSystem(use_mmap=memory_map)
+    partitioning = ds.HivePartitioning.discover(infer_dictionary=True)
+    return ds.dataset(store_dir, format=_dataset_format(fmt), partitioning=partitioning, filesystem=filesystem)
+
+
+def read_features(store_dir=DEFAULT_STORE_DIR, columns=None, filters=None, fmt='parquet', memory_map=True):
+    """
+    Read features from the store.
+
+    Parameters:
+    - store_dir (str): root folder of the dataset.
+    - columns (list): columns to load, None for all. Other columns are never read from disk.
+    - filters: row filter pushed down to the scan, as [(column, op, value), ...] tuples like
+      pandas.read_parquet or a pyarrow.dataset expression. Filters on partition columns
+      (run_date, cluster_label) skip whole folders, the others skip Parquet row groups using
+      their statistics, e.g. [('cluster_label', '=', 'Free Checked Bag'), ('age', '>=', 30)].
+    - fmt (str): format the store was written with.
+    - memory_map (bool): memory map the files instead of reading them into buffers; with
+      Feather the columns are loaded without a copy.
+
+    Returns:
+    - pd.DataFrame.
+    """
+    dataset = open_features(store_dir, fmt, memory_map)
+    table = dataset.to_table(columns=columns, filter=_filter_expression(filters))
+    return table.to_pandas()
+
+
+def latest_run_date(store_dir=DEFAULT_STORE_DIR, fmt='parquet'):
+    """
+    Most recent run_date in the store, None when it has no run_date partitions.
+    """
+    dataset = open_features(store_dir, fmt, memory_map=False)
+    if 'run_date' not in dataset.schema.names:
+        return None
+    run_dates = dataset.to_table(columns=['run_date']).column('run_date').unique().to_pylist()
+    return max(run_dates) if run_dates else None
@@ -0,0 +1,170 @@
+# Import the needed libraries
+
+import pandas as pd
+
+
+class ClusterSummary:
+    """
+    Per cluster sums, counts and means of a labelled frame, computed in a single grouped pass.
+
+    Build it once from the clustered DataFrame and pass it to the cluster plots and tab widgets
+    (summary=...) so each view reads the cached aggregates instead of scanning the frame again
+    with one boolean mask per cluster.
+
+    Parameters:
+    - df: pandas DataFrame with one row per user and a cluster column.
+    - cluster_column: name of the column with the cluster numbers.
+    - label_column: name of the column with the cluster labels, None when there is none.
+    - columns: columns to aggregate, default every numeric and boolean column.
+    """
+
+    def __init__(self, df, cluster_column='cluster', label_column='cluster_label', columns=None):
+        if columns is None:
+            columns = [column for column in df.select_dtypes(include=['number', 'bool']).columns if column != cluster_column]
+        self.cluster_column = cluster_column
+        self.columns = list(columns)
+
+        grouped = df.groupby(cluster_column, sort=True)
+        aggregates = grouped[self.columns].agg(['sum', 'count'])
+        self._sums = aggregates.xs('sum', axis=1, level=1)
+        self._counts = aggregates.xs('count', axis=1, level=1)
+        self._means = self._sums / self._counts
+        self.sizes = grouped.size()
+
+        if label_column is not None and label_column in df:
+            self.labels = grouped[label_column].first()
+        else:
+            self.labels = pd.Series(self.sizes.index.astype(str), index=self.sizes.index)
+
+    @property
+    def clusters(self):
+        return self.sizes.index.tolist()
+
+    def means(self, columns=None):
+        """
+        Mean of each column per cluster (NULLs ignored, like DataFrame.mean), clusters as rows.
+        """
+        return self._means if columns is None else self._means[list(columns)]
+
+    def sums(self, columns=None):
+        """
+        Sum of each column per cluster, clusters as rows.
+        """
+        return self._sums if columns is None else self._sums[list(columns)]
+
+    def counts(self, columns=None):
+        """
+        Number of non-null values of each column per cluster, clusters as rows.
+        """
+        return self._counts if columns is None else self._counts[list(columns)]
+
+    def label_list(self):
+        """
+        Cluster labels in cluster order.
+        """
+        return self.labels.tolist()
+
+
+def _top_rows(counts, group_column, value_column, top_n):
+    # Largest value_column rows per group: stable sort then cumcount, ties keep their current order
+    ordered = counts.sort_values([group_column, value_column], ascending=[True, False], kind='stable')
+    return ordered[ordered.groupby(group_column, observed=True).cumcount() < top_n].reset_index(drop=True)
+
+
+def top_n_per_group(df, group_column, category_column, top_n=5, value_column='count'):
+    """
+    Most frequent categories of every group, e.g. the top home cities per cluster.
+
+    Same result as groupby([group, category]).size() followed by nlargest per group, without a
+    Python level apply.
+
+    Parameters:
+    - df (pd.DataFrame): one row per user.
+    - group_column (str): column to group by, e.g. 'cluster_label'.
+    - category_column (str): column to count, e.g. 'home_city'.
+    - top_n (int): categories kept per group.
+    - value_column (str): name of the count column of the result.
+
+    Returns:
+    - pd.DataFrame with group_column, category_column and value_column, groups in order and
+      counts descending inside each group.
+    """
+    counts = df.groupby([group_column, category_column], observed=True).size().reset_index(name=value_column)
+    return _top_rows(counts, group_column, value_column, top_n)
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters sketch per group, for top categories over chunked input.
+
+    Keeps at most capacity counters per group. Every chunk is counted exactly and merged into the
+    sketch: a category without a counter starts from the smallest counter of a full group, which
+    is recorded as its error. Estimated counts are never below the true count and overestimate it
+    by at most error (itself at most rows of the group / capacity), so with a capacity a few
+    times top_n the heavy categories and their order are exact in practice.
+
+    Parameters:
+    - group_column (str): column to group by, e.g. 'cluster_label'.
+    - category_column (str): column to count, e.g. 'home_city'.
+    - capacity (int): counters kept per group.
+    """
+
+    def __init__(self, group_column, category_column, capacity=100):
+        self.group_column = group_column
+        self.category_column = category_column
+        self.capacity = capacity
+        self.counters = pd.DataFrame({group_column: [], category_column: [], 'count': [], 'error': []})
+
+    def _merge_counters(self, other):
+        keys = [self.group_column, self.category_column]
+        merged = self.counters.merge(other, on=keys, how='outer', suffixes=('', '_other'))
+
+        # Categories missing from one side count as that side's smallest counter of a full group
+        # (0 when the group still has free counters)
+        floors = []
+        for counters in (self.counters, other):
+            grouped = counters.groupby(self.group_column, observed=True)['count']
+            floors.append(grouped.min().where(grouped.size() >= self.capacity, 0))
+        for suffix, floor in zip(('', '_other'), floors):
+            missing = merged['count' + suffix].isna()
+            fill = merged[self.group_column].map(floor).fillna(0)
+            merged['count' + suffix] = merged['count' + suffix].fillna(fill)
+            merged['error' + suffix] = merged['error' + suffix].where(~missing, fill)
+
+        merged['count'] = merged['count'] + merged['count_other']
+        merged['error'] = merged['error'] + merged['error_other']
+        self.counters = _top_rows(merged[keys + ['count', 'error']], self.group_column, 'count', self.capacity)
+        return self
+
+    def update(self, chunk):
+        """
+        Add a DataFrame chunk, returns self.
+        """
+        counts = chunk.groupby([self.group_column, self.category_column], observed=True).size().reset_index(name='count')
+        counts['count'] = counts['count'].astype(float)
+        counts['error'] = 0.0
+        return self._merge_counters(counts)
+
+    def merge(self, other):
+        """
+        Add the counters of another sketch (same columns and capacity), returns self.
+        """
+        return self._merge_counters(other.counters)
+
+    def top(self, top_n=5, value_column='count'):
+        """
+        Top categories per group like top_n_per_group, with an error column (0 means exact).
+        """
+        top = _top_rows(self.counters, self.group_column, 'count', top_n)
+        top[['count', 'error']] = top[['count', 'error']].astype('int64')
+        return top.rename(columns={'count': value_column})
+
+
+def top_n_per_group_streaming(chunks, group_column, category_column, top_n=5, value_column='count', capacity=100):
+    """
+    Approximate top_n_per_group over a stream of DataFrame chunks with a SpaceSaving sketch.
+    """
+    sketch = SpaceSaving(group_column, category_column, capacity)
+    for chunk in chunks:
+        sketch.update(chunk)
+    return sketch.top(top_n, value_column)
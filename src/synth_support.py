@@ -0,0 +1,270 @@
+# Import the needed libraries
+
+import os
+import numpy as np
+import pandas as pd
+from src import db_support as dbs
+from src.distance_support import haversine_km
+from src.lazy_support import lazy_import
+
+sa = lazy_import('sqlalchemy')
+
+# Synthetic TravelTide data with the same users / sessions / flights / hotels schema as the
+# production database, so db_support and the SQL files can be tested and benchmarked locally
+# without the private DATABASE_URL. Scale 1 is BASE_USERS users, scale 10 ten times as many, etc.
+
+BASE_USERS = 10000
+SESSIONS_PER_USER = 9          # mean of the negative binomial session count
+FIRST_SESSION = pd.Timestamp('2022-01-01')
+LAST_SESSION = pd.Timestamp('2023-07-28')
+
+# Home / destination airports: code, city, country, lat, lon, weight as home airport
+AIRPORTS = pd.DataFrame([
+    ('JFK', 'new york', 'usa', 40.640, -73.779, 12),
+    ('LGA', 'new york', 'usa', 40.777, -73.873, 6),
+    ('LAX', 'los angeles', 'usa', 33.942, -118.408, 9),
+    ('ORD', 'chicago', 'usa', 41.979, -87.904, 7),
+    ('DFW', 'dallas', 'usa', 32.897, -97.038, 5),
+    ('IAH', 'houston', 'usa', 29.984, -95.341, 5),
+    ('SFO', 'san francisco', 'usa', 37.619, -122.375, 5),
+    ('SEA', 'seattle', 'usa', 47.449, -122.309, 4),
+    ('ATL', 'atlanta', 'usa', 33.641, -84.427, 4),
+    ('MIA', 'miami', 'usa', 25.793, -80.291, 4),
+    ('BOS', 'boston', 'usa', 42.364, -71.005, 4),
+    ('MCI', 'kansas city', 'usa', 39.298, -94.714, 2),
+    ('DEN', 'denver', 'usa', 39.856, -104.674, 3),
+    ('YYZ', 'toronto', 'canada', 43.677, -79.631, 6),
+    ('YVR', 'vancouver', 'canada', 49.195, -123.184, 3),
+    ('YUL', 'montreal', 'canada', 45.471, -73.741, 3),
+    ('LHR', 'london', 'uk', 51.470, -0.454, 0),
+    ('CDG', 'paris', 'france', 49.010, 2.548, 0),
+    ('NRT', 'tokyo', 'japan', 35.765, 140.386, 0),
+    ('CUN', 'cancun', 'mexico', 21.037, -86.877, 0),
+], columns=['code', 'city', 'country', 'lat', 'lon', 'home_weight'])
+
+AIRLINES = ['American Airlines', 'Delta Air Lines', 'United Airlines', 'Air Canada', 'Southwest Airlines', 'JetBlue Airways']
+HOTEL_BRANDS = ['Marriott', 'Hilton', 'Hyatt', 'Accor', 'Wyndham', 'Best Western', 'Choice Hotels']
+DISCOUNT_AMOUNTS = np.array([0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45])
+DISCOUNT_WEIGHTS = np.array([30, 25, 15, 10, 7, 5, 4, 2, 2]) / 100
+
+
+def _random_times(rng, start, end, size):
+    seconds = rng.integers(0, int((end - start).total_seconds()), size)
+    return start + pd.to_timedelta(seconds, unit='s')
+
+
+def generate_users(rng, first_user_id, n_users):
+    """
+    Users with an age around 40, a weighted home airport and a sign up date before 2023-07.
+    """
+    weights = AIRPORTS['home_weight'] / AIRPORTS['home_weight'].sum()
+    home = AIRPORTS.iloc[rng.choice(len(AIRPORTS), n_users, p=weights)].reset_index(drop=True)
+    age_days = np.clip(rng.normal(41, 12, n_users), 16, 88) * 365.25
+    birthdate = (pd.Timestamp('2023-07-28') - pd.to_timedelta(age_days, unit='D')).normalize()
+
+    return pd.DataFrame({
+        'user_id': np.arange(first_user_id, first_user_id + n_users),
+        'birthdate': birthdate.date,
+        'gender': rng.choice(['F', 'M', 'O'], n_users, p=[0.55, 0.44, 0.01]),
+        'married': rng.random(n_users) < 0.44,
+        'has_children': rng.random(n_users) < 0.33,
+        'home_country': home['country'],
+        'home_city': home['city'],
+        'home_airport': home['code'],
+        'home_airport_lat': home['lat'],
+        'home_airport_lon': home['lon'],
+        'sign_up_date': _random_times(rng, pd.Timestamp('2021-04-01'), pd.Timestamp('2023-06-30'), n_users).normalize().date,
+    })
+
+
+def generate_sessions(rng, users, first_session_id):
+    """
+    Browsing / booking sessions per user. About a third of the sessions book a flight and/or a
+    hotel (a new trip_id), a few percent of those trips get a later cancellation session that
+    repeats the trip_id, and discounts are offered independently of booking.
+    """
+    counts = rng.negative_binomial(4, 4 / (4 + SESSIONS_PER_USER), len(users))
+    user_id = np.repeat(users['user_id'].to_numpy(), counts)
+    n = len(user_id)
+
+    # Sessions lean towards 2023 like the production data
+    recent = rng.random(n) < 0.7
+    session_start = np.where(
+        recent,
+        _random_times(rng, pd.Timestamp('2023-01-04'), LAST_SESSION, n),
+        _random_times(rng, FIRST_SESSION, LAST_SESSION, n),
+    )
+    session_start = pd.to_datetime(session_start)
+    # Whole seconds like the production timestamp columns, a sub-second session_end would be
+    # stored with more precision than a watermark read back from it
+    duration = pd.to_timedelta(np.round(np.clip(rng.lognormal(4.5, 0.8, n), 10, 3600 * 2)).astype(np.int64), unit='s')
+    page_clicks = np.maximum(1, (duration.total_seconds() / 12 + rng.poisson(3, n))).astype(int)
+
+    flight_discount = rng.random(n) < 0.17
+    hotel_discount = rng.random(n) < 0.14
+    flight_booked = rng.random(n) < 0.28 + 0.1 * flight_discount
+    hotel_booked = np.where(flight_booked, rng.random(n) < 0.7, rng.random(n) < 0.08 + 0.08 * hotel_discount)
+    booked = flight_booked | hotel_booked
+
+    trip_number = np.cumsum(booked) + first_session_id
+    trip_id = np.where(booked, pd.Series(user_id).astype(str) + '-' + trip_number.astype(str), None)
+
+    sessions = pd.DataFrame({
+        'user_id': user_id,
+        'trip_id': trip_id,
+        'session_start': session_start,
+        'session_end': session_start + duration,
+        'flight_discount': flight_discount,
+        'hotel_discount': hotel_discount,
+        'flight_discount_amount': np.where(flight_discount, rng.choice(DISCOUNT_AMOUNTS, n, p=DISCOUNT_WEIGHTS), np.nan),
+        'hotel_discount_amount': np.where(hotel_discount, rng.choice(DISCOUNT_AMOUNTS, n, p=DISCOUNT_WEIGHTS), np.nan),
+        'flight_booked': flight_booked,
+        'hotel_booked': hotel_booked,
+        'page_clicks': page_clicks,
+        'cancellation': False,
+    })
+
+    # Cancellation sessions come back a few days later for the same trip
+    cancelled = sessions[booked & (rng.random(n) < 0.05)].copy()
+    later = pd.to_timedelta(rng.integers(1, 30, len(cancelled)), unit='D')
+    cancelled['session_start'] = cancelled['session_start'] + later
+    cancelled['session_end'] = cancelled['session_end'] + later
+    cancelled['flight_discount'] = False
+    cancelled['hotel_discount'] = False
+    cancelled['flight_discount_amount'] = np.nan
+    cancelled['hotel_discount_amount'] = np.nan
+    cancelled['page_clicks'] = rng.integers(1, 8, len(cancelled))
+    cancelled['cancellation'] = True
+
+    sessions = pd.concat([sessions, cancelled], ignore_index=True).sort_values(['user_id', 'session_start'], kind='stable')
+    session_number = pd.Series(np.arange(first_session_id, first_session_id + len(sessions)), index=sessions.index)
+    sessions.insert(0, 'session_id', session_number.astype(str) + '-' + sessions['user_id'].astype(str))
+    return sessions.reset_index(drop=True)
+
+
+def generate_trips(rng, users, sessions):
+    """
+    Flight and hotel rows for the booking sessions (cancellation sessions reuse the trip).
+    """
+    bookings = sessions[sessions['trip_id'].notna() & ~sessions['cancellation']]
+    home = users.set_index('user_id').loc[bookings['user_id'], ['home_airport', 'home_airport_lat', 'home_airport_lon']]
+    home = home.reset_index(drop=True)
+    bookings = bookings.reset_index(drop=True)
+
+    departure = bookings['session_start'] + pd.to_timedelta(rng.integers(1, 120, len(bookings)), unit='D')
+    trip_days = rng.geometric(0.3, len(bookings))
+
+    flights = bookings[bookings['flight_booked']]
+    origin = home.loc[flights.index].reset_index(drop=True)
+    # Any airport but the home one
+    origin_position = pd.Index(AIRPORTS['code']).get_indexer(origin['home_airport'])
+    destination_position = (origin_position + rng.integers(1, len(AIRPORTS), len(flights))) % len(AIRPORTS)
+    destination = AIRPORTS.iloc[destination_position].reset_index(drop=True)
+    distance = haversine_km(origin['home_airport_lat'], origin['home_airport_lon'], destination['lat'], destination['lon'])
+    seats = rng.choice([1, 2, 3, 4], len(flights), p=[0.6, 0.25, 0.1, 0.05])
+    flight_table = pd.DataFrame({
+        'trip_id': flights['trip_id'].to_numpy(),
+        'origin_airport': origin['home_airport'],
+        'destination': destination['city'],
+        'destination_airport': destination['code'],
+        'seats': seats,
+        'return_flight_booked': rng.random(len(flights)) < 0.9,
+        'departure_time': departure[flights.index].to_numpy(),
+        'return_time': (departure[flights.index] + pd.to_timedelta(trip_days[flights.index], unit='D')).to_numpy(),
+        'checked_bags': rng.poisson(0.6, len(flights)),
+        'trip_airline': rng.choice(AIRLINES, len(flights)),
+        'destination_airport_lat': destination['lat'],
+        'destination_airport_lon': destination['lon'],
+        'base_fare_usd': np.round((60 + 0.12 * distance) * seats * rng.lognormal(0, 0.25, len(flights)), 2),
+    })
+
+    hotels = bookings[bookings['hotel_booked']]
+    nights = trip_days[hotels.index]
+    # A small share of stays have check out before check in, like the production data
+    nights = np.where(rng.random(len(hotels)) < 0.01, -rng.integers(1, 3, len(hotels)), nights)
+    check_in = departure[hotels.index] + pd.to_timedelta(rng.integers(10, 20, len(hotels)), unit='h')
+    destination_city = rng.choice(AIRPORTS['city'], len(hotels))
+    hotel_table = pd.DataFrame({
+        'trip_id': hotels['trip_id'].to_numpy(),
+        'hotel_name': pd.Series(rng.choice(HOTEL_BRANDS, len(hotels))) + ' - ' + destination_city,
+        'nights': nights,
+        'rooms': rng.choice([1, 2, 3], len(hotels), p=[0.8, 0.17, 0.03]),
+        'check_in_time': check_in.to_numpy(),
+        'check_out_time': (check_in + pd.to_timedelta(np.abs(nights), unit='D')).to_numpy(),
+        'hotel_per_room_usd': np.round(rng.lognormal(5.1, 0.45, len(hotels))),
+    })
+
+    return flight_table, hotel_table
+
+
+def generate_batches(scale=1, seed=42, batch_users=50000):
+    """
+    Yield dicts of users / sessions / flights / hotels DataFrames, batch_users users at a time,
+    so even the 100x scale is generated with bounded memory.
+    """
+    rng = np.random.default_rng(seed)
+    n_users = int(BASE_USERS * scale)
+    next_session_id = 1
+    for first in range(0, n_users, batch_users):
+        users = generate_users(rng, first + 1, min(batch_users, n_users - first))
+        sessions = generate_sessions(rng, users, next_session_id)
+        next_session_id += len(sessions)
+        flights, hotels = generate_trips(rng, users, sessions)
+        yield {'users': users, 'sessions': sessions, 'flights': flights, 'hotels': hotels}
+
+
+def build_duckdb(path, scale=1, seed=42, batch_users=50000, overwrite=False):
+    """
+    Generate the dataset into an embedded DuckDB file (needs the duckdb package).
+
+    Parameters:
+    - path (str): DuckDB database file.
+    - scale (float): multiple of BASE_USERS users.
+    - seed (int): random seed, the same seed and scale always give the same data.
+    - batch_users (int): users generated and inserted per batch.
+    - overwrite (bool): rebuild the file when it already exists.
+
+    Returns:
+    - dict of table name to row count.
+    """
+    import duckdb
+
+    if os.path.exists(path):
+        if not overwrite:
+            raise FileExistsError(f"{path} already exists, pass overwrite=True to rebuild it")
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with duckdb.connect(path) as connection:
+        created = set()
+        for batch in generate_batches(scale, seed, batch_users):
+            for table, frame in batch.items():
+                connection.register('batch_frame', frame)
+                if table in created:
+                    connection.execute(f"INSERT INTO {table} SELECT * FROM batch_frame")
+                else:
+                    connection.execute(f"CREATE TABLE {table} AS SELECT * FROM batch_frame")
+                    created.add(table)
+                connection.unregister('batch_frame')
+        return {table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in sorted(created)}
+
+
+def load_into_database(database_url=None, scale=1, seed=42, batch_users=50000):
+    """
+    Generate the dataset into any SQLAlchemy database, e.g. a local PostgreSQL stand-in.
+    Uses the db_support engine when database_url is None. Tables are replaced.
+    """
+    engine = dbs.get_engine() if database_url is None else sa.create_engine(database_url)
+    first_batch = True
+    for batch in generate_batches(scale, seed, batch_users):
+        with engine.begin() as connection:
+            for table, frame in batch.items():
+                frame.to_sql(table, connection, if_exists='replace' if first_batch else 'append', index=False, chunksize=10000)
+        first_batch = False
+
+
+def use_duckdb(path):
+    """
+    Point db_support at a local DuckDB file (needs duckdb-engine), e.g. one made by build_duckdb.
+    """
+    dbs.configure_engine(f'duckdb:///{os.path.abspath(path)}', autocommit=False)
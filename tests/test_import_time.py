@@ -0,0 +1,10 @@
+import pytest
+from src import lazy_support
+
+
+@pytest.mark.parametrize('module', lazy_support.src_modules())
+def test_cold_import_within_budget(module):
+    # A fresh interpreter per run, see lazy_support.check_import_times
+    [row] = lazy_support.check_import_times({module: lazy_support.import_budgets()[module]})
+    assert row['ok'], (f"{module} imported in {row['seconds']}s (budget {row['budget']}s), "
+                       f"heavy modules loaded eagerly: {row['heavy_modules']}")